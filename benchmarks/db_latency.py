@@ -0,0 +1,62 @@
+"""
+ব্লকিং pymongo কল বনাম db_call থ্রেডপুলের লেটেন্সি তুলনা।
+
+আসল Mongo লাগে না: একটি নকল কালেকশন প্রতিটি কোয়েরিতে নির্দিষ্ট সময় ঘুমায় (নেটওয়ার্ক রাউন্ড ট্রিপের মতো),
+আর N জন ইউজারের হ্যান্ডলার একসাথে চালানো হয়।
+
+    python benchmarks/db_latency.py --users 200 --rtt-ms 40
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+
+class SlowCollection:
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    def find_one(self, query):
+        time.sleep(self.rtt)
+        return {"user_id": query.get("user_id")}
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(mode, col, users):
+    # সব আপডেট একসাথে আসে; লেটেন্সি = আপডেট আসা থেকে হ্যান্ডলার শেষ হওয়া পর্যন্ত (লুপে অপেক্ষার সময়সহ)
+    latencies = []
+    t0 = time.perf_counter()
+
+    async def handler(uid):
+        if mode == "blocking": col.find_one({"user_id": uid})
+        else: await bot.db_call(col.find_one, {"user_id": uid})
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    await asyncio.gather(*(handler(uid) for uid in range(users)))
+    return latencies, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--rtt-ms", type=float, default=40)
+    args = ap.parse_args()
+    col = SlowCollection(args.rtt_ms / 1000)
+
+    print(f"{args.users} concurrent users, {args.rtt_ms:.0f} ms round trip, pool size {bot.DB_POOL_SIZE}")
+    for mode in ("blocking", "db_call"):
+        lat, wall = asyncio.run(run(mode, col, args.users))
+        print(f"{mode:>9}: wall {wall * 1000:8.1f} ms | p50 {statistics.median(lat):8.1f} ms | p95 {pct(lat, 95):8.1f} ms | {args.users / wall:8.1f} updates/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+অফলাইন হ্যান্ডলার বেঞ্চমার্ক: আসল হ্যান্ডলারগুলো সিনথেটিক Update দিয়ে Application.process_update এর মাধ্যমে চালায়।
+
+- টেলিগ্রাম: একটি স্টাব BaseRequest নকল রেসপন্স দেয় (ঐচ্ছিক --tg-latency-ms দেরিসহ), তাই Bot এর পুরো কোড চলে কিন্তু নেটওয়ার্ক লাগে না।
+- Mongo: ডিফল্টে mongomock (ইন-মেমোরি, `pip install mongomock`); --mongo দিলে লোকাল MongoDB তে একটি স্ক্র্যাচ ডাটাবেজ।
+- প্রতিটি ইউজার পুরো ফ্লো চালায়: /post → get_name … get_link → post_callback, btn_status/btn_offers, /redeem → save_redeem।
+
+    python benchmarks/handlers.py --users 50 --save baseline.json
+    python benchmarks/handlers.py --users 50 --compare baseline.json
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "1")
+import bot  # noqa: E402
+from pymongo.collection import Collection  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+_ids = itertools.count(1)
+
+
+class StubTelegram(BaseRequest):
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def initialize(self): pass
+    async def shutdown(self): pass
+
+    @property
+    def read_timeout(self): return 5.0
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if self.latency: await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint.startswith(("send", "edit")):
+            result = {"message_id": next(_ids), "date": int(time.time()), "from": BOT_USER,
+                      "chat": {"id": int(params.get("chat_id") or 0), "type": "private"}, "text": str(params.get("text", ""))}
+            if endpoint == "sendDocument":
+                result["document"] = {"file_id": f"BENCHFILE{result['message_id']}", "file_unique_id": f"U{result['message_id']}"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def user_dict(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+
+
+def message_update(application, uid, text):
+    msg = {"message_id": next(_ids), "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "from": user_dict(uid), "text": text}
+    if text.startswith("/"): msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.de_json({"update_id": next(_ids), "message": msg}, application.bot)
+
+
+def callback_update(application, uid, data):
+    msg = {"message_id": next(_ids), "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "from": BOT_USER, "text": "menu"}
+    cq = {"id": str(next(_ids)), "from": user_dict(uid), "chat_instance": "bench", "data": data, "message": msg}
+    return Update.de_json({"update_id": next(_ids), "callback_query": cq}, application.bot)
+
+
+def use_database(uri):
+    # bot মডিউলের সব *_col কে স্ক্র্যাচ ডাটাবেজে সরিয়ে দেয়
+    if uri:
+        from pymongo import MongoClient
+        client = MongoClient(uri)
+        scratch = client["handler_bench"]
+        cleanup = lambda: client.drop_database("handler_bench")
+    else:
+        import mongomock
+        from mongomock.collection import BulkOperationBuilder
+        # নতুন pymongo bulk অপারেশনে sort আর্গুমেন্ট পাঠায় যা mongomock চেনে না
+        for name in ("add_update", "add_replace"):
+            orig = getattr(BulkOperationBuilder, name)
+            setattr(BulkOperationBuilder, name, lambda self, *a, _orig=orig, sort=None, **k: _orig(self, *a, **k))
+        scratch = mongomock.MongoClient()["handler_bench"]
+        cleanup = lambda: None
+        # mongomock pipeline আপডেটে তারিখ যোগ করতে পারে না; একই ফলাফলের read-modify-write বিকল্প
+        def extend_premium(user_id, days):
+            cur = bot.profiles_col.find_one({"user_id": user_id}) or {}
+            base = max(cur.get("expiry_date", datetime.datetime.min), datetime.datetime.now())
+            new_exp = base + datetime.timedelta(days=days)
+            bot.profiles_col.update_one({"user_id": user_id}, {"$set": {"expiry_date": new_exp}, "$unset": {"warned": ""}}, upsert=True)
+            return new_exp
+        bot.extend_premium = extend_premium
+    for name in dir(bot):
+        col = getattr(bot, name)
+        if name.endswith("_col") and isinstance(col, Collection): setattr(bot, name, scratch[col.name])
+    if uri: bot.ensure_indexes()
+    return cleanup
+
+
+def use_posters(tmpdir):
+    # পোস্টার নেটওয়ার্ক থেকে না এনে একটি সিনথেটিক JPEG দেয়; রিসাইজ/এনকোড খরচ আসলের মতোই থাকে
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (1000, 1500), (200, 80, 40)).save(buf, "JPEG")
+    data = buf.getvalue()
+    bot.fetch_image = lambda url: data
+    bot.POSTER_DIR = tmpdir
+
+
+def seed(users):
+    far = datetime.datetime.now() + datetime.timedelta(days=30)
+    bot.premium_col.insert_many([{"user_id": u, "expiry_date": far} for u in users])
+    bot.settings_col.insert_many([{"user_id": u, "click_limit": 3, "monetag_link": "https://example.com/ad"} for u in users])
+    bot.channels_col.insert_many([{"user_id": u, "name": f"Channel {i}", "url": f"https://t.me/c{i}"} for u in users for i in range(3)])
+    bot.offers_col.insert_many([{"title": f"Offer {i}", "price": "100", "days": "30"} for i in range(3)])
+    bot.codes_col.insert_many([{"code": f"BENCH{u:06d}", "days": 7} for u in users])
+    # পুরনো কালেকশনে সিড করে মাইগ্রেশন দিয়েই profiles তৈরি হয়
+    bot.migrate_profiles()
+
+
+async def user_flow(application, uid, timings):
+    async def step(label, update):
+        t0 = time.perf_counter()
+        await application.process_update(update)
+        timings.setdefault(label, []).append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await bot.get_profile(uid)
+    timings.setdefault("get_profile", []).append(time.perf_counter() - t0)
+
+    await step("start_post", message_update(application, uid, "/post"))
+    await step("get_name", message_update(application, uid, f"Movie {uid}"))
+    await step("get_poster", message_update(application, uid, "https://example.com/poster.jpg"))
+    await step("get_year", message_update(application, uid, "2024"))
+    await step("get_language", message_update(application, uid, "Bangla"))
+    for q in ("480p", "720p"):
+        await step("get_quality", message_update(application, uid, q))
+        await step("get_link", message_update(application, uid, f"https://example.com/{q}"))
+        if q != "720p": await step("post_callback", callback_update(application, uid, "add_q_c"))
+    await step("post_callback", callback_update(application, uid, "done_q_c"))
+
+    await step("menu_callback_handler", callback_update(application, uid, "btn_status"))
+    await step("menu_callback_handler", callback_update(application, uid, "btn_offers"))
+
+    await step("start_redeem", message_update(application, uid, "/redeem"))
+    await step("save_redeem", message_update(application, uid, f"BENCH{uid:06d}"))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summarize(timings, wall):
+    total = sum(len(v) for k, v in timings.items() if k != "get_profile")
+    report = {"updates_per_sec": total / wall, "wall_sec": wall, "handlers": {}}
+    for label, values in sorted(timings.items()):
+        report["handlers"][label] = {"n": len(values), **{f"p{p}": percentile(values, p) * 1000 for p in (50, 95, 99)}}
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"{'handler':<24}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, r in report["handlers"].items():
+        line = f"{label:<24}{r['n']:>6}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['p99']:>10.2f}"
+        base = baseline and baseline["handlers"].get(label)
+        if base: line += f"   p95 {(r['p95'] - base['p95']) / max(base['p95'], 1e-9):+.0%}"
+        print(line)
+    line = f"updates/sec: {report['updates_per_sec']:.1f}"
+    if baseline: line += f" (baseline {baseline['updates_per_sec']:.1f}, {(report['updates_per_sec'] - baseline['updates_per_sec']) / baseline['updates_per_sec']:+.0%})"
+    print(line)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--mongo", help="লোকাল MongoDB URI; না দিলে mongomock")
+    ap.add_argument("--tg-latency-ms", type=float, default=0)
+    ap.add_argument("--save", help="ফলাফল JSON বেসলাইন হিসেবে সেভ")
+    ap.add_argument("--compare", help="আগের বেসলাইনের সাথে তুলনা")
+    args = ap.parse_args()
+
+    cleanup = use_database(args.mongo)
+    poster_dir = tempfile.TemporaryDirectory()
+    use_posters(poster_dir.name)
+    users = list(range(1000, 1000 + args.users))
+    seed(users)
+    application = bot.build_application("123456:BENCH", request=StubTelegram(args.tg_latency_ms / 1000))
+    await application.initialize()
+    timings = {}
+    try:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(user_flow(application, uid, timings) for uid in users))
+        report = summarize(timings, time.perf_counter() - t0)
+    finally:
+        await application.shutdown()
+        cleanup()
+        poster_dir.cleanup()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w") as f: json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+/preview রুটের লোড টেস্ট: requests/sec আর লেটেন্সি মাপে।
+
+চলমান সার্ভারের বিরুদ্ধে (আগের ও নতুন ডিপ্লয় তুলনা করতে):
+    python benchmarks/preview_load.py --url https://example.com/preview/<p_id>
+
+লোকালি, নকল Mongo (প্রতি কোয়েরিতে --rtt-ms দেরি) দিয়ে ডেভ সার্ভার বনাম waitress:
+    python benchmarks/preview_load.py --local dev
+    python benchmarks/preview_load.py --local waitress --etag
+
+ওয়েবহুক মোড (uvicorn + make_asgi_app, Flask অংশ WEB_THREADS ওয়ার্কারে):
+    python benchmarks/preview_load.py --local webhook
+"""
+import argparse
+import logging
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_local(server, rtt):
+    import bot
+    from bson import ObjectId
+
+    oid = ObjectId()
+    doc = {"_id": oid, "user_id": 1, "name": "Benchmark Movie", "poster": "https://example.com/p.jpg", "year": "2024", "lang": "Bangla",
+           "items": [{"q": q, "l": f"https://example.com/{q}"} for q in ("480p", "720p", "1080p")],
+           "settings": {"click_limit": 3, "monetag_link": "https://example.com/ad"},
+           "channels": [{"name": f"Channel {i}", "url": f"https://t.me/c{i}"} for i in range(5)]}
+
+    class StubPreviews:
+        def find_one(self, query):
+            time.sleep(rtt)
+            return doc if query["_id"] == oid else None
+
+    bot.previews_col = StubPreviews()
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    if server == "dev":
+        target = lambda: bot.app.run(host="127.0.0.1", port=port)
+    elif server == "webhook":
+        import asyncio
+        import types
+        import uvicorn
+        # Flask রুটগুলো Telegram অ্যাপ্লিকেশন ছোঁয় না, তাই ওয়েবহুক অংশের জন্য একটি খালি স্ট্যান্ড-ইন যথেষ্ট
+        asgi = bot.make_asgi_app(types.SimpleNamespace(bot=None, update_queue=asyncio.Queue()))
+        server = uvicorn.Server(uvicorn.Config(asgi, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+        target = lambda: asyncio.run(server.serve())
+    else:
+        target = lambda: bot.serve(bot.app, host="127.0.0.1", port=port, threads=int(os.environ.get("WEB_THREADS", 8)), _quiet=True)
+    threading.Thread(target=target, daemon=True).start()
+    url = f"http://127.0.0.1:{port}/preview/{oid}"
+    for _ in range(50):
+        try:
+            requests.get(url, timeout=1)
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    return url
+
+
+def worker(url, deadline, etag, latencies, errors):
+    session = requests.Session()
+    headers = {"Accept-Encoding": "gzip, br"}
+    if etag: headers["If-None-Match"] = etag
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            r = session.get(url, headers=headers, timeout=10)
+            if r.status_code not in (200, 304): errors.append(r.status_code)
+        except requests.RequestException as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url")
+    ap.add_argument("--local", choices=("dev", "waitress", "webhook"))
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--rtt-ms", type=float, default=30)
+    ap.add_argument("--etag", action="store_true", help="প্রথম রেসপন্সের ETag পাঠিয়ে 304 পাথ মাপে")
+    args = ap.parse_args()
+    if not args.url and not args.local: ap.error("--url অথবা --local দিন")
+
+    url = args.url or start_local(args.local, args.rtt_ms / 1000)
+    etag = requests.get(url, headers={"Accept-Encoding": "gzip, br"}).headers.get("ETag") if args.etag else None
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(url, deadline, etag, latencies, errors)) for _ in range(args.concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+    print(f"{args.local or url} | {args.concurrency} clients | {len(latencies) / args.duration:.1f} req/s | "
+          f"p50 {statistics.median(latencies) if latencies else 0:.1f} ms | p95 {p95:.1f} ms | errors {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
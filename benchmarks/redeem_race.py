@@ -0,0 +1,119 @@
+"""
+রিডিম কনকারেন্সি চেক: একটি কোডে একসাথে অনেক redeem_code() চালিয়ে দেখে শুধু একজনই সফল হয়,
+আর একই ইউজারের একাধিক কোড একসাথে রিডিম হলে সব দিন যোগ হয়। মেয়াদ বাড়ানো ব্যর্থ হলে কোড ফেরত আসে কিনা তাও দেখে।
+
+আসল MongoDB (MONGO_URI) তে --db নামের একটি আলাদা স্ক্র্যাচ ডাটাবেজ ব্যবহার করে শেষে মুছে ফেলে:
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/redeem_race.py --parallel 200
+
+MongoDB না থাকলে --mock (mongomock, `pip install mongomock`): কোড ক্লেইমের রেস আর কোড ফেরত আসা আসলভাবেই চলে।
+mongomock aggregation-pipeline আপডেটে তারিখ যোগ করতে পারে না, তাই দিন যোগের বদলে যাচাই হয় যে প্রতিটি
+রিডিম ঠিক একটি সার্ভার-সাইড pipeline আপডেট ($max "$expiry_date" থেকে যোগ, upsert) পাঠায়।
+    python benchmarks/redeem_race.py --mock --parallel 200
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+from pymongo import ReturnDocument  # noqa: E402
+
+
+class PipelineSpy:
+    # mongomock এর জায়গায় profiles কালেকশন: extend_premium এর আপডেট রেকর্ড করে, নতুন মেয়াদ হিসেবে এখনকার সময় দেয়
+    def __init__(self):
+        self.calls = []
+
+    def find_one_and_update(self, query, update, **kwargs):
+        self.calls.append((query, update, kwargs))
+        return {"expiry_date": datetime.datetime.now()}
+
+
+async def race_one_code(parallel, spy=None):
+    bot.codes_col.insert_one({"code": "RACE000001", "days": 30})
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(bot.redeem_code(1000 + i, "RACE000001") for i in range(parallel)))
+    elapsed = time.perf_counter() - t0
+    winners = [r for r in results if r]
+    print(f"{parallel} parallel redeems of one code: {len(winners)} succeeded in {elapsed * 1000:.1f} ms")
+    extended = len(spy.calls) if spy else bot.profiles_col.count_documents({})
+    return len(winners) == 1 and extended == 1
+
+
+async def stack_codes(parallel):
+    uid, days = 42, 3
+    bot.codes_col.insert_many([{"code": f"STACK{i:05d}", "days": days} for i in range(parallel)])
+    before = datetime.datetime.now()
+    await asyncio.gather(*(bot.redeem_code(uid, f"STACK{i:05d}") for i in range(parallel)))
+    expiry = bot.profiles_col.find_one({"user_id": uid})["expiry_date"]
+    expected = before + datetime.timedelta(days=days * parallel)
+    drift = abs((expiry - expected).total_seconds())
+    print(f"{parallel} codes redeemed in parallel by one user: expiry off by {drift:.1f}s from {days * parallel} days")
+    return drift < 60
+
+
+async def stack_codes_shape(parallel, spy):
+    # প্রতিটি রিডিম একটি করে অ্যাটমিক সার্ভার-সাইড আপডেট পাঠালে একসাথে রিডিমেও কোনো দিন হারায় না
+    spy.calls.clear()
+    bot.codes_col.insert_many([{"code": f"STACK{i:05d}", "days": 3} for i in range(parallel)])
+    await asyncio.gather(*(bot.redeem_code(42, f"STACK{i:05d}") for i in range(parallel)))
+    ok = len(spy.calls) == parallel
+    for query, update, kwargs in spy.calls:
+        stages = update if isinstance(update, list) else []
+        uses_current = any("$expiry_date" in str(st.get("$set", {}).get("expiry_date")) for st in stages)
+        ok = ok and query == {"user_id": 42} and uses_current and kwargs.get("upsert") and kwargs.get("return_document") == ReturnDocument.AFTER
+    print(f"{parallel} codes redeemed in parallel by one user: {len(spy.calls)} single-document pipeline updates, shape {'ok' if ok else 'WRONG'}")
+    return ok
+
+
+async def restore_on_failure():
+    bot.codes_col.insert_one({"code": "FAIL000001", "days": 7})
+    extend, failed = bot.extend_premium, False
+
+    def broken(user_id, days): raise TimeoutError("simulated network error")
+    bot.extend_premium = broken
+    try: await bot.redeem_code(7, "FAIL000001")
+    except TimeoutError: failed = True
+    finally: bot.extend_premium = extend
+    restored = bot.codes_col.count_documents({"code": "FAIL000001"}) == 1
+    print(f"extend failure: error raised {failed}, code restored {restored}")
+    return failed and restored
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--parallel", type=int, default=100)
+    ap.add_argument("--db", default="redeem_race_check")
+    ap.add_argument("--mock", action="store_true", help="MongoDB ছাড়া mongomock দিয়ে")
+    args = ap.parse_args()
+
+    spy = None
+    if args.mock:
+        import mongomock
+        client = mongomock.MongoClient()
+        spy = PipelineSpy()
+    elif not bot.MONGO_URI: sys.exit("MONGO_URI দিন অথবা --mock")
+    else: client = bot.client
+
+    scratch = client[args.db]
+    bot.codes_col, bot.profiles_col = scratch["redeem_codes"], spy or scratch["profiles"]
+    bot.codes_col.create_index("code", unique=True)
+    if not spy: bot.profiles_col.create_index("user_id", unique=True)
+    try:
+        ok = await race_one_code(args.parallel, spy)
+        if spy: ok = await stack_codes_shape(min(args.parallel, 50), spy) and ok
+        else:
+            bot.profiles_col.delete_many({})
+            ok = await stack_codes(min(args.parallel, 50)) and ok
+        ok = await restore_on_failure() and ok
+    finally:
+        client.drop_database(args.db)
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,17 +1,45 @@
 import os
+import sys
 import logging
 import threading
 import time
 import requests
+import urllib3
+import certifi
 import datetime
 import html
-import random
+import io
+import secrets
 import string
-from flask import Flask, render_template_string
-from pymongo import MongoClient
+import gzip
+import hashlib
+import hmac
+import zlib
+import ipaddress
+import re
+import socket
+import json
+import asyncio
+import csv
+import atexit
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, send_from_directory
+from urllib.parse import urlparse, urljoin
+from PIL import Image, ImageOps
+from waitress import serve
+from pymongo import MongoClient, ReturnDocument, ReplaceOne, DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo import monitoring
+import bson
 from bson.objectid import ObjectId
+try: import brotli
+except ImportError: brotli = None
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -19,33 +47,602 @@ from telegram.ext import (
     filters,
     ContextTypes,
     ConversationHandler,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    BasePersistence,
+    PersistenceInput,
+    CallbackContext
 )
 
 # --- রেন্ডার ও ফ্লস্ক সেটিংস ---
 app = Flask(__name__)
 
+# --- মেট্রিক্স ---
+# METRICS_ENABLED=1 হলে হ্যান্ডলার, Mongo, টেলিগ্রাম API আর /preview এর লেটেন্সি /metrics এ Prometheus ফরম্যাটে পাওয়া যায়।
+# বন্ধ থাকলে কোনো র‍্যাপার বা লিসেনার বসানো হয় না, তাই খরচ প্রায় শূন্য।
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hists = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None: h = self._hists[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, b in enumerate(LATENCY_BUCKETS):
+                if seconds <= b: h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + value
+
+    @staticmethod
+    def _fmt(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items: return ""
+        return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+    def render(self):
+        with self._lock:
+            hists, counters = {k: list(v) for k, v in self._hists.items()}, dict(self._counters)
+        lines, typed = [], set()
+        for (name, labels), h in sorted(hists.items()):
+            if name not in typed: lines.append(f"# TYPE {name} histogram"); typed.add(name)
+            for b, n in zip(LATENCY_BUCKETS, h): lines.append(f"{name}_bucket{self._fmt(labels, [('le', b)])} {n}")
+            lines.append(f"{name}_bucket{self._fmt(labels, [('le', '+Inf')])} {h[-1]}")
+            lines.append(f"{name}_sum{self._fmt(labels)} {h[-2]}")
+            lines.append(f"{name}_count{self._fmt(labels)} {h[-1]}")
+        for (name, labels), n in sorted(counters.items()):
+            if name not in typed: lines.append(f"# TYPE {name} counter"); typed.add(name)
+            lines.append(f"{name}{self._fmt(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class MongoMetricsListener(monitoring.CommandListener):
+    # কালেকশনের নাম শুধু started ইভেন্টে থাকে, তাই request_id ধরে রাখা হয়
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        cmd = event.command
+        coll = cmd.get('collection') if event.command_name == 'getMore' else cmd.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = coll if isinstance(coll, str) else "-"
+
+    def _done(self, event, failed):
+        coll = self._pending.pop((event.connection_id, event.request_id), "-")
+        metrics.observe("bot_mongo_seconds", event.duration_micros / 1e6, collection=coll, op=event.command_name)
+        if failed: metrics.inc("bot_mongo_errors_total", collection=coll, op=event.command_name)
+
+    def succeeded(self, event): self._done(event, False)
+    def failed(self, event): self._done(event, True)
+
+class TimedRequest(HTTPXRequest):
+    async def do_request(self, url, method, *args, **kwargs):
+        t0 = time.perf_counter()
+        try: return await super().do_request(url, method, *args, **kwargs)
+        finally: metrics.observe("bot_telegram_api_seconds", time.perf_counter() - t0, method=url.rsplit('/', 1)[-1])
+
+def timed_handler(callback):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        t0 = time.perf_counter()
+        try: return await callback(update, context)
+        finally: metrics.observe("bot_handler_seconds", time.perf_counter() - t0, handler=callback.__name__)
+    return wrapper
+
+def instrument_handlers(application):
+    # __main__ এ রেজিস্টার করা প্রতিটি হ্যান্ডলার (কনভারসেশনের ভেতরেরগুলোসহ) র‍্যাপ করা হয়
+    def walk(handlers):
+        for h in handlers:
+            if isinstance(h, ConversationHandler):
+                walk(h.entry_points)
+                for state_handlers in h.states.values(): walk(state_handlers)
+                walk(h.fallbacks)
+            else: h.callback = timed_handler(h.callback)
+    for group in application.handlers.values(): walk(group)
+
+@app.route('/metrics')
+def metrics_page():
+    if not METRICS_ENABLED: return "metrics disabled", 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # ডাটাবেজ কানেকশন
 MONGO_URI = os.environ.get('MONGO_URI')
-client = MongoClient(MONGO_URI)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+client = MongoClient(MONGO_URI, maxPoolSize=DB_POOL_SIZE, event_listeners=[MongoMetricsListener()] if METRICS_ENABLED else [])
 db = client['movie_bot_final_v15_fixed']
+# প্রতি ইউজারের প্রিমিয়াম মেয়াদ, সেটিংস আর চ্যানেল একটি ডকুমেন্টে
+profiles_col = db['profiles']
+# পুরনো আলাদা কালেকশন, শুধু migrate_profiles এর সোর্স
 channels_col = db['channels']
 settings_col = db['settings']
 premium_col = db['premium_users']
 codes_col = db['redeem_codes']
 offers_col = db['premium_offers']
 previews_col = db['previews']
+users_col = db['users']
+broadcasts_col = db['broadcasts']
+state_col = db['bot_state']
+post_stats_col = db['post_stats']
+daily_stats_col = db['daily_stats']
+posters_col = db['posters']
+sent_files_col = db['sent_files']
+
+# --- অ্যাসিঙ্ক ডাটাবেজ লেয়ার ---
+# pymongo ব্লকিং, তাই হ্যান্ডলারের সব কোয়েরি একটি সীমিত থ্রেডপুলে চলে; এতে ইভেন্ট লুপ আটকে না থেকে অন্য ইউজারের আপডেট চলতে থাকে
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='mongo')
+
+async def db_call(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+async def db_find(col, *args, **kwargs):
+    return await db_call(lambda: list(col.find(*args, **kwargs)))
+
+# --- ইনডেক্স ---
+# (কালেকশন, কী, অপশন) — প্রতিটি find_one/find এর ফিল্টার যেন ইনডেক্স ব্যবহার করে
+INDEXES = [
+    (profiles_col, [("user_id", 1)], {"unique": True}),
+    (codes_col, [("code", 1)], {"unique": True}),
+    (codes_col, [("batch", 1)], {}),
+    (profiles_col, [("expiry_date", 1)], {}),
+    (users_col, [("user_id", 1)], {"unique": True}),
+    (broadcasts_col, [("status", 1)], {}),
+    (state_col, [("kind", 1)], {}),
+    (post_stats_col, [("user_id", 1), ("_id", -1)], {}),
+    (daily_stats_col, [("user_id", 1), ("day", -1)], {}),
+    # প্রিভিউ লাইফসাইকেল: expires_at না থাকলে (বা null) কখনো মোছে না
+    (previews_col, [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    (previews_col, [("user_id", 1), ("content_hash", 1)], {"unique": True, "partialFilterExpression": {"content_hash": {"$exists": True}}}),
+    # উপরেরটি partial, তাই শুধু user_id এর কোয়েরি (যেমন Retention বদলানো) এটি ব্যবহার করতে পারে না
+    (previews_col, [("user_id", 1)], {}),
+    # অসমাপ্ত ড্রাফট (কনভারসেশন ও user_data) নিষ্ক্রিয় থাকলে মুছে যায়
+    (state_col, [("updated_at", 1)], {"expireAfterSeconds": int(os.environ.get('DRAFT_TTL_DAYS', 7)) * 86400}),
+]
+
+# হ্যান্ডলারগুলোর হট কোয়েরি, --explain মোডে যাচাই করা হয়
+# (কালেকশন, কোয়েরি, সর্ট); তারিখের মান শুধু প্ল্যান দেখার জন্য
+_EXPLAIN_AT = datetime.datetime(2000, 1, 1)
+HOT_QUERIES = [
+    (profiles_col, {"user_id": 0}, None),
+    (codes_col, {"code": ""}, None),
+    (previews_col, {"user_id": 0, "content_hash": ""}, None),
+    (previews_col, {"user_id": 0}, None),
+    (profiles_col, {"expiry_date": {"$gt": _EXPLAIN_AT, "$lte": _EXPLAIN_AT}, "warned": {"$ne": True}}, None),
+    (profiles_col, {"expiry_date": {"$lte": _EXPLAIN_AT}}, None),
+    (broadcasts_col, {"status": "running"}, None),
+    (profiles_col, {"expiry_date": {"$gt": _EXPLAIN_AT}, "user_id": {"$gt": 0}}, [("user_id", 1)]),
+    (users_col, {"user_id": {"$gt": 0}}, [("user_id", 1)]),
+    (post_stats_col, {"user_id": 0}, [("_id", -1)]),
+    (daily_stats_col, {"user_id": 0}, [("day", -1)]),
+]
+
+def ensure_indexes():
+    # create_index আইডেম্পোটেন্ট, তাই প্রতিবার স্টার্টআপে চালানো নিরাপদ
+    for col, keys, opts in INDEXES:
+        try: col.create_index(keys, **opts)
+        except Exception as e: logging.error(f"{col.name} কালেকশনে ইনডেক্স তৈরি ব্যর্থ: {e}")
+
+def _plan_stages(plan):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan: yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []): yield from _plan_stages(child)
+
+def check_query_plans():
+    # প্রতিটি হট কোয়েরির explain চালিয়ে দেখে কোনটি এখনো পুরো কালেকশন স্ক্যান (COLLSCAN) করছে
+    report = []
+    for col, query, sort in HOT_QUERIES:
+        cursor = col.find(query)
+        if sort: cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = [st for st in _plan_stages(plan) if st]
+        report.append((col.name, query, "COLLSCAN" not in stages, " -> ".join(reversed(stages))))
+    return report
+
+# --- রিড-থ্রু ক্যাশ ---
+# প্রিমিয়াম স্ট্যাটাস, অফার আর সেটিংস খুব কম বদলায় কিন্তু প্রায় প্রতিটি ক্লিকে পড়া হয়; রাইটের সময় invalidate করা হয়
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+_MISS = object()
+
+class TTLCache:
+    def __init__(self, ttl, maxsize=4096):
+        self.ttl, self.maxsize = ttl, maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=_MISS):
+        with self._lock:
+            item = self._data.get(key)
+            if item and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item: del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def invalidate(self, key=_MISS):
+        with self._lock:
+            if key is _MISS: self._data.clear()
+            else: self._data.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+profile_cache = TTLCache(CACHE_TTL)
+offers_cache = TTLCache(CACHE_TTL, maxsize=1)
+# রেন্ডার করা প্রিভিউ HTML; প্রিভিউ বদলায় না, তাই লম্বা TTL
+preview_cache = TTLCache(int(os.environ.get('PREVIEW_CACHE_TTL', 3600)), maxsize=int(os.environ.get('PREVIEW_CACHE_SIZE', 512)))
+
+async def cached(cache, key, loader):
+    value = cache.get(key)
+    if value is _MISS:
+        value = await loader()
+        cache.set(key, value)
+    return value
+
+async def get_profile(user_id):
+    return await cached(profile_cache, user_id, lambda: db_call(profiles_col.find_one, {"user_id": user_id}))
+
+async def update_profile(user_id, update):
+    res = await db_call(profiles_col.update_one, {"user_id": user_id}, update, upsert=True)
+    profile_cache.invalidate(user_id)
+    return res
+
+class BotContext(CallbackContext):
+    # PTB প্রতিটি আপডেটে একটি নতুন কনটেক্সট বানায়; প্রোফাইল এখানে রাখলে এক আপডেটে সব হ্যান্ডলার একবারই পড়ে
+    async def profile(self):
+        if '_profile' not in self.__dict__: self._profile = await get_profile(self._user_id) or {}
+        return self._profile
+
+    async def is_authorized(self):
+        return is_premium(self._user_id, await self.profile())
+
+async def get_offers():
+    return await cached(offers_cache, "all", lambda: db_find(offers_col))
+
+# --- প্রিভিউ টেমপ্লেট ---
+# প্রিভিউ ডাটাবেজে স্ট্রাকচার্ড ডাটা হিসেবে থাকে, HTML একটি প্রি-কম্পাইলড টেমপ্লেট থেকে রেন্ডার হয়
+PREVIEW_HTML = """
+<!DOCTYPE html><html><head><meta name="viewport" content="width=device-width, initial-scale=1.0"></head><body style="background:#f4f4f4; display:flex; justify-content:center; padding:20px;">
+<div style="text-align:center;border:2px solid #eee;padding:20px;border-radius:15px;font-family:sans-serif;max-width:450px;width:100%;background:#fff;box-shadow:0 5px 15px rgba(0,0,0,0.1);">
+    {% if poster_base %}<picture><source type="image/webp" srcset="{{ poster_base }}-320.webp 320w, {{ poster_base }}-640.webp 640w" sizes="(max-width: 450px) 100vw, 410px"><img src="{{ poster_base }}-640.jpg" srcset="{{ poster_base }}-320.jpg 320w, {{ poster_base }}-640.jpg 640w" sizes="(max-width: 450px) 100vw, 410px" style="width:100%;border-radius:10px;margin-bottom:15px;" /></picture>{% else %}<img src="{{ poster }}" style="width:100%;border-radius:10px;margin-bottom:15px;" />{% endif %}
+    <h2 style="color:#222;margin:5px 0;">{{ name }} ({{ year }})</h2>
+    <p style="color:#555;margin-bottom:15px;"><b>Language:</b> {{ lang }}</p>
+    <div style="background:#f9f9f9;padding:15px;border-radius:10px;border:1px dashed #ccc;margin-bottom:15px;">
+        <p id="counter-text" style="font-weight:bold;color:#d9534f;margin-bottom:10px;">Steps: 0 / {{ settings.click_limit }}</p>
+        <div style="width: 100%; background: #ddd; height: 8px; border-radius: 5px; margin-bottom: 15px; overflow: hidden;">
+            <div id="progress-bar" style="width: 0%; background: #d9534f; height: 100%; transition: 0.3s;"></div>
+        </div>
+        {% for i in items %}<div style="margin-bottom: 10px;"><button class="dl-btn" onclick='processClick({{ i.l|tojson }})' style="background:#d9534f;color:#fff;padding:12px 20px;border:none;border-radius:5px;font-weight:bold;width:100%;cursor:pointer;">📥 Download {{ i.q }}</button></div>{% endfor %}
+    </div>
+    <div style="margin-top:10px;">{% for c in channels %}<a href="{{ c.url }}" style="background:#333;color:#fff;padding:5px 10px;margin:2px;text-decoration:none;border-radius:3px;font-size:12px;display:inline-block;">{{ c.name }}</a>{% endfor %}</div>
+</div>
+<script>
+let clicks = 0; const limit = {{ settings.click_limit|int }}; const adUrl = {{ settings.monetag_link|tojson }}; const beacon = {{ beacon_url|tojson }};
+function track(ev) { if (navigator.sendBeacon) navigator.sendBeacon(beacon + "/" + ev); }
+track("view");
+function processClick(finalUrl) {
+    if (clicks < limit) { window.open(adUrl, "_blank"); clicks++; track("click");
+        document.getElementById('progress-bar').style.width = (clicks/limit)*100 + "%";
+        document.getElementById('counter-text').innerText = "Steps: " + clicks + " / " + limit;
+        if (clicks >= limit) { track("unlock");
+            document.querySelectorAll('.dl-btn').forEach(b => { b.style.background = "#28a745"; b.innerText = b.innerText.replace("Download", "Get Link"); });
+            document.getElementById('counter-text').style.color = "#28a745"; document.getElementById('counter-text').innerText = "Link Unlocked!";
+        }
+    } else { window.location.href = finalUrl; }
+}
+</script></body></html>"""
+preview_template = app.jinja_env.from_string(PREVIEW_HTML)
+
+def render_preview(doc):
+    if 'packed' in doc: doc = {**doc, **unpack_preview(doc['packed'])}
+    # পুরনো প্রিভিউতে পুরো HTML সংরক্ষিত থাকে, সেগুলো যেমন আছে তেমন দেখানো হয়
+    if 'html' in doc: return doc['html']
+    base_url = os.environ.get('APP_URL', '')
+    poster_base = f"{base_url}/poster/{doc['poster_hash']}" if doc.get('poster_hash') else None
+    return preview_template.render(**doc, beacon_url=f"{base_url}/beacon/{doc['_id']}", poster_base=poster_base)
+
+# --- প্রিভিউ লাইফসাইকেল ---
+# expires_at (ইউজারের retention_days থেকে) TTL ইনডেক্সে মোছে; একই কনটেন্ট content_hash দিয়ে একটিই ডক;
+# ঠান্ডা প্রিভিউ কম্প্যাকশনে zlib করা এক ফিল্ডে (packed) চলে যায়, URL একই থাকে
+PREVIEW_COLD_DAYS = int(os.environ.get('PREVIEW_COLD_DAYS', 30))
+COMPACT_INTERVAL = 24 * 3600
+COMPACT_BATCH = 500
+RETENTION_CHOICES = {7: "৭ দিন", 30: "৩০ দিন", 90: "৯০ দিন", 0: "চিরকাল"}
+PREVIEW_META_FIELDS = ("_id", "user_id", "name", "created_at", "expires_at", "content_hash")
+
+def preview_content_hash(doc):
+    content = {k: v for k, v in doc.items() if k not in ("_id", "created_at", "expires_at", "content_hash")}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+def save_previews(uid, docs):
+    # content_hash → সংরক্ষিত ডক; আগে থেকে থাকা বা একই ব্যাচে একাধিকবার আসা কনটেন্ট নতুন করে ইনসার্ট হয় না, শুধু মেয়াদ নবায়ন হয়
+    saved = {d['content_hash']: d for d in previews_col.find({"user_id": uid, "content_hash": {"$in": list({d['content_hash'] for d in docs})}})}
+    if saved: previews_col.update_many({"_id": {"$in": [d['_id'] for d in saved.values()]}}, {"$set": {"expires_at": docs[0]['expires_at']}})
+    fresh = {}
+    for d in docs:
+        if d['content_hash'] not in saved: fresh.setdefault(d['content_hash'], {"_id": ObjectId(), **d})
+    new = list(fresh.values())
+    if new:
+        try: previews_col.insert_many(new, ordered=False)
+        except BulkWriteError as e:
+            # সমান্তরাল অন্য রিকোয়েস্ট একই কনটেন্ট এইমাত্র ইনসার্ট করেছে; তার কপিটিই নেওয়া হয়
+            if any(err['code'] != 11000 for err in e.details['writeErrors']): raise
+            lost = [new[err['index']]['content_hash'] for err in e.details['writeErrors']]
+            for h in lost: del fresh[h]
+            saved.update({d['content_hash']: d for d in previews_col.find({"user_id": uid, "content_hash": {"$in": lost}})})
+    return {**saved, **fresh}
+
+def unpack_preview(packed):
+    return json.loads(zlib.decompress(packed))
+
+def compact_previews(cold_days=PREVIEW_COLD_DAYS):
+    # cold_days এর চেয়ে পুরনো আর এই সময়ে কোনো ভিউ/ক্লিক নেই এমন প্রিভিউ আর্কাইভ করে; (সংখ্যা, খালি হওয়া বাইট) ফেরত দেয়
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=cold_days)
+    oid_cutoff = ObjectId.from_datetime(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=cold_days))
+    count = reclaimed = 0
+
+    def compact_batch(batch):
+        nonlocal count, reclaimed
+        warm = {s['_id'] for s in post_stats_col.find({"_id": {"$in": [str(d['_id']) for d in batch]}, "last_event": {"$gte": cutoff}}, {"_id": 1})}
+        ops, saved = [], 0
+        for d in batch:
+            if str(d['_id']) in warm: continue
+            payload = {k: v for k, v in d.items() if k not in PREVIEW_META_FIELDS}
+            archived = {**{k: d[k] for k in PREVIEW_META_FIELDS if k in d}, "packed": zlib.compress(json.dumps(payload, ensure_ascii=False, default=str).encode(), 9)}
+            delta = len(bson.encode(d)) - len(bson.encode(archived))
+            if delta <= 0: continue
+            ops.append(ReplaceOne({"_id": d['_id'], "packed": {"$exists": False}}, archived))
+            saved += delta
+        if ops:
+            count += previews_col.bulk_write(ops, ordered=False).modified_count
+            reclaimed += saved
+
+    batch = []
+    for d in previews_col.find({"_id": {"$lt": oid_cutoff}, "packed": {"$exists": False}}).sort("_id", 1).batch_size(COMPACT_BATCH):
+        batch.append(d)
+        if len(batch) >= COMPACT_BATCH: compact_batch(batch); batch = []
+    if batch: compact_batch(batch)
+    if METRICS_ENABLED: metrics.inc("bot_previews_reclaimed_bytes_total", reclaimed)
+    return count, reclaimed
+
+# --- পোস্টার প্রক্সি ---
+# পোস্ট তৈরির সময় ছবি একবার আনা হয়, ছোট WebP/JPEG ভ্যারিয়েন্ট বানিয়ে কনটেন্ট-হ্যাশ নামে ডিস্কে রাখা হয়।
+# হ্যাশ → আসল URL posters কালেকশনে থাকে, তাই ডিস্ক মুছে গেলেও প্রথম রিকোয়েস্টে আবার তৈরি হয়।
+POSTER_DIR = os.path.abspath(os.environ.get('POSTER_DIR', 'posters'))
+POSTER_MAX_BYTES = int(os.environ.get('POSTER_MAX_BYTES', 10 * 1024 * 1024))
+POSTER_WIDTHS = (320, 640)
+POSTER_FORMATS = (("webp", "WEBP"), ("jpg", "JPEG"))
+POSTER_NAME_RE = re.compile(r'^([0-9a-f]{24})-(\d+)\.(webp|jpg)$')
+
+def _resolve_public(host):
+    # হোস্টের সব ঠিকানা পাবলিক হলে getaddrinfo এর ক্রমে (IPv4 আগে) সবগুলো ফেরত দেয়, কোনোটি প্রাইভেট হলে None
+    infos = sorted(socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP), key=lambda info: info[0] != socket.AF_INET)
+    ips = list(dict.fromkeys(info[4][0] for info in infos))
+    try: return ips if ips and all(ipaddress.ip_address(ip).is_global for ip in ips) else None
+    except ValueError: return None
+
+def fetch_image(url, redirects=3):
+    # যাচাই করা IP তেই কানেক্ট করা হয় (Host হেডার/SNI আসল হোস্টের), তাই DNS rebinding এ ইন্টারনাল ঠিকানায় যাওয়া যায় না;
+    # রিডাইরেক্ট নিজে অনুসরণ করা হয় যাতে প্রতিটি হপেও একই যাচাই হয়।
+    # ভুল লিংক/ছবি হলে ValueError, নেটওয়ার্ক বা HTTP সমস্যায় ConnectionError
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname: raise ValueError("invalid url")
+    try: ips = _resolve_public(parsed.hostname)
+    except socket.gaierror as e: raise ConnectionError(f"DNS: {e}")
+    if not ips: raise ValueError("invalid url")
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    timeout, last_error = urllib3.Timeout(connect=5, read=10), None
+    for ip in ips:
+        if parsed.scheme == 'https':
+            pool = urllib3.HTTPSConnectionPool(ip, parsed.port or 443, timeout=timeout, retries=False, server_hostname=parsed.hostname,
+                                               assert_hostname=parsed.hostname, cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+        else: pool = urllib3.HTTPConnectionPool(ip, parsed.port or 80, timeout=timeout, retries=False)
+        try:
+            # কানেক্ট না হলে (যেমন IPv6 আউটবাউন্ড নেই) পরের ঠিকানায় চেষ্টা
+            try: r = pool.urlopen("GET", path, headers={"Host": parsed.netloc.rsplit("@", 1)[-1]}, redirect=False, preload_content=False)
+            except urllib3.exceptions.HTTPError as e:
+                last_error = e
+                continue
+            if r.get_redirect_location() and redirects: return fetch_image(urljoin(url, r.get_redirect_location()), redirects - 1)
+            if r.status >= 400: raise ConnectionError(f"HTTP {r.status}")
+            if not r.headers.get('Content-Type', '').startswith('image/'): raise ValueError("not an image")
+            data = b""
+            try:
+                for chunk in r.stream(65536):
+                    data += chunk
+                    if len(data) > POSTER_MAX_BYTES: raise ValueError("image too large")
+            except urllib3.exceptions.HTTPError as e: raise ConnectionError(str(e))
+            return data
+        finally: pool.close()
+    raise ConnectionError(f"কোনো ঠিকানায় কানেক্ট হয়নি: {last_error}")
+
+def store_poster(url):
+    # ছবি এনে ভ্যারিয়েন্টগুলো ডিস্কে লেখে (ডাটাবেজ ছাড়া), কনটেন্ট হ্যাশ ফেরত দেয়; ভুল লিংক/ছবি হলে এক্সেপশন
+    data = fetch_image(url)
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    paths = {(w, ext): os.path.join(POSTER_DIR, f"{digest}-{w}.{ext}") for w in POSTER_WIDTHS for ext, _ in POSTER_FORMATS}
+    if not all(os.path.exists(p) for p in paths.values()):
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        os.makedirs(POSTER_DIR, exist_ok=True)
+        for w in POSTER_WIDTHS:
+            variant = img if img.width <= w else img.resize((w, round(img.height * w / img.width)), Image.LANCZOS)
+            for ext, fmt in POSTER_FORMATS:
+                tmp = f"{paths[(w, ext)]}.{secrets.token_hex(4)}.tmp"
+                variant.save(tmp, fmt, quality=80)
+                os.replace(tmp, paths[(w, ext)])
+    return digest
+
+def record_poster(digest, url):
+    posters_col.update_one({"_id": digest}, {"$setOnInsert": {"url": url, "created_at": datetime.datetime.now()}}, upsert=True)
+
+def ingest_poster(url):
+    digest = store_poster(url)
+    record_poster(digest, url)
+    return digest
+
+async def ingest_poster_async(url):
+    # ডাউনলোড/রিসাইজ ডিফল্ট এক্সিকিউটরে, Mongo রাইট db_call এর সীমিত পুলে
+    digest = await asyncio.get_running_loop().run_in_executor(None, store_poster, url)
+    await db_call(record_poster, digest, url)
+    return digest
+
+@app.route('/poster/<name>')
+def poster_file(name):
+    m = POSTER_NAME_RE.match(name)
+    if not m or int(m.group(2)) not in POSTER_WIDTHS: return "", 404
+    if not os.path.exists(os.path.join(POSTER_DIR, name)):
+        src = posters_col.find_one({"_id": m.group(1)})
+        try:
+            if not src or ingest_poster(src['url']) != m.group(1): return "", 404
+        except Exception: return "", 404
+    resp = send_from_directory(POSTER_DIR, name, max_age=31536000)
+    resp.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+    return resp
+
+# --- ভিউ/ক্লিক অ্যানালিটিক্স ---
+# বিকন প্রতি হিটে রাইট করে না: মেমোরিতে গুনে STATS_FLUSH_INTERVAL পরপর $inc bulk upsert এ Mongo তে যায়
+STATS_FLUSH_INTERVAL = int(os.environ.get('STATS_FLUSH_INTERVAL', 30))
+STATS_EVENTS = {"view": "views", "click": "clicks", "unlock": "unlocks"}
+
+class StatsAggregator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._posts = {}
+        self._daily = {}
+        self._flusher = None
+
+    def add(self, p_id, user_id, name, field, n=1):
+        day = datetime.datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            post = self._posts.setdefault(p_id, {"user_id": user_id, "name": name, "inc": {}})
+            post["inc"][field] = post["inc"].get(field, 0) + n
+            daily = self._daily.setdefault((user_id, day), {})
+            daily[field] = daily.get(field, 0) + n
+            if not self._flusher:
+                # প্রথম হিটে চালু হয়, তাই gunicorn এর প্রতিটি ওয়ার্কারেও নিজের ফ্লাশার থাকে
+                self._flusher = threading.Thread(target=self._run, daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(STATS_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            posts, daily, self._posts, self._daily = self._posts, self._daily, {}, {}
+        if not posts and not daily: return
+        now = datetime.datetime.now()
+        posts, daily = list(posts.items()), list(daily.items())
+        post_ops = [UpdateOne({"_id": p_id}, {"$inc": p["inc"], "$max": {"last_event": now}, "$setOnInsert": {"user_id": p["user_id"], "name": p["name"]}}, upsert=True) for p_id, p in posts]
+        daily_ops = [UpdateOne({"_id": f"{uid}:{day}"}, {"$inc": inc, "$setOnInsert": {"user_id": uid, "day": day}}, upsert=True) for (uid, day), inc in daily]
+        failed_posts, failed_daily = self._write(post_stats_col, post_ops), self._write(daily_stats_col, daily_ops)
+        # শুধু ব্যর্থ অপারেশনের গণনা পরের ফ্লাশের জন্য ফেরত যায়, সফলগুলো দুবার গোনা হয় না
+        with self._lock:
+            for i in failed_posts:
+                p_id, p = posts[i]
+                post = self._posts.setdefault(p_id, {"user_id": p["user_id"], "name": p["name"], "inc": {}})
+                for field, n in p["inc"].items(): post["inc"][field] = post["inc"].get(field, 0) + n
+            for i in failed_daily:
+                key, inc = daily[i]
+                merged = self._daily.setdefault(key, {})
+                for field, n in inc.items(): merged[field] = merged.get(field, 0) + n
+
+    @staticmethod
+    def _write(col, ops):
+        # ব্যর্থ অপারেশনের ইনডেক্স ফেরত দেয়
+        if not ops: return set()
+        try:
+            col.bulk_write(ops, ordered=False)
+            return set()
+        except BulkWriteError as e:
+            logging.error(f"{col.name} স্ট্যাটস ফ্লাশ আংশিক ব্যর্থ: {len(e.details['writeErrors'])}টি")
+            return {err['index'] for err in e.details['writeErrors']}
+        except Exception as e:
+            # নেটওয়ার্ক এরর: কোনটি লেখা হয়েছে জানা যায় না, তাই পুরো ব্যাচ আবার চেষ্টা হয়
+            logging.error(f"{col.name} স্ট্যাটস ফ্লাশ ব্যর্থ: {e}")
+            return set(range(len(ops)))
+
+stats_agg = StatsAggregator()
+atexit.register(stats_agg.flush)
+
+# --- HTTP ক্যাশিং ---
+# প্রতিটি রেন্ডার করা পেজ একবারই কম্প্রেস হয়; ETag দিয়ে ব্রাউজার/CDN রি-ভ্যালিডেট করে 304 পায়
+PREVIEW_MAX_AGE = int(os.environ.get('PREVIEW_MAX_AGE', 300))
+
+def make_page_entry(page, doc):
+    body = page.encode('utf-8')
+    entry = {"etag": hashlib.sha256(body).hexdigest()[:32], "identity": body, "gzip": gzip.compress(body, 6), "user_id": doc.get('user_id'), "name": doc.get('name')}
+    if brotli: entry["br"] = brotli.compress(body)
+    return entry
+
+def minify_html(page):
+    # কমেন্ট, ইনডেন্ট, ফাঁকা লাইন আর ট্যাগের মাঝের স্পেস বাদ; লাইন ব্রেক থাকে যাতে JS এর সেমিকোলন-ছাড়া লাইন না ভাঙে
+    page = re.sub(r'<!--.*?-->', '', page, flags=re.S)
+    return re.sub(r'>\s+<', '><', "\n".join(line.strip() for line in page.splitlines() if line.strip()))
+
+def page_response(entry):
+    # কনটেন্ট-এনকোডিং অনুযায়ী আলাদা strong ETag
+    encoding = next((enc for enc in ("br", "gzip") if enc in entry and request.accept_encodings[enc]), "identity")
+    etag = entry["etag"] if encoding == "identity" else f"{entry['etag']}-{encoding}"
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={PREVIEW_MAX_AGE}", "Vary": "Accept-Encoding"}
+    if request.if_none_match.contains(etag): return Response(status=304, headers=headers)
+    if encoding != "identity": headers["Content-Encoding"] = encoding
+    return Response(entry[encoding], mimetype="text/html", headers=headers)
 
 # লাইভ প্রিভিউ ওয়েব রুট
 @app.route('/preview/<p_id>')
 def preview_page(p_id):
-    try:
-        preview_data = previews_col.find_one({"_id": ObjectId(p_id)})
-        if preview_data:
-            return render_template_string(preview_data['html'])
-        return "<h1>Preview Not Found!</h1>", 404
-    except:
-        return "<h1>Invalid Preview ID!</h1>", 400
+    if not METRICS_ENABLED: return _preview_page(p_id)
+    t0 = time.perf_counter()
+    resp = _preview_page(p_id)
+    status = resp[1] if isinstance(resp, tuple) else resp.status_code
+    metrics.observe("bot_preview_seconds", time.perf_counter() - t0)
+    metrics.inc("bot_preview_requests_total", status=status)
+    return resp
+
+def _preview_page(p_id):
+    entry, error = load_preview_entry(p_id)
+    return error or page_response(entry)
+
+def load_preview_entry(p_id):
+    # (entry, None) অথবা (None, এরর রেসপন্স)
+    entry = preview_cache.get(p_id)
+    if METRICS_ENABLED: metrics.inc("bot_preview_cache_total", result="miss" if entry is _MISS else "hit")
+    if entry is _MISS:
+        try: preview_data = previews_col.find_one({"_id": ObjectId(p_id)})
+        except: return None, ("<h1>Invalid Preview ID!</h1>", 400)
+        if not preview_data: return None, ("<h1>Preview Not Found!</h1>", 404)
+        entry = make_page_entry(render_preview(preview_data), preview_data)
+        preview_cache.set(p_id, entry)
+    return entry, None
+
+@app.route('/beacon/<p_id>/<event>', methods=['POST'])
+def preview_beacon(p_id, event):
+    if event not in STATS_EVENTS: return "", 400
+    entry, error = load_preview_entry(p_id)
+    if error: return "", error[1]
+    stats_agg.add(p_id, entry['user_id'], entry['name'], STATS_EVENTS[event])
+    return "", 204
 
 @app.route('/')
 def home(): return "বট সচল আছে! (Master Bot Online)", 200
@@ -58,9 +655,64 @@ def keep_alive():
         except: pass
         time.sleep(300)
 
+# --- ওয়েবহুক মোড ---
+# BOT_MODE=webhook হলে টেলিগ্রাম আপডেট আর /preview রুট একই async সার্ভারে (uvicorn) চলে; পোলিং ও keep_alive থ্রেড লাগে না
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', 16))
+
+async def _plain_response(send, status, body=b""):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": body})
+
+def make_asgi_app(application):
+    # asgiref এর WsgiToAsgi সব রিকোয়েস্ট একটি থ্রেডে চালায়; a2wsgi তে waitress এর মতো WEB_THREADS ওয়ার্কার পুল
+    from a2wsgi import WSGIMiddleware
+    flask_asgi = WSGIMiddleware(app, workers=int(os.environ.get('WEB_THREADS', 8)))
+
+    async def telegram_webhook(scope, receive, send):
+        headers = dict(scope['headers'])
+        if not hmac.compare_digest(headers.get(b"x-telegram-bot-api-secret-token", b""), WEBHOOK_SECRET.encode()):
+            return await _plain_response(send, 403, b"forbidden")
+        body, more = b"", True
+        while more:
+            msg = await receive()
+            body, more = body + msg.get("body", b""), msg.get("more_body", False)
+        try: data = json.loads(body)
+        except ValueError: data = None
+        if not isinstance(data, dict): return await _plain_response(send, 400, b"bad update")
+        # ডিক্ট হলেও ভুল গঠনের আপডেটে de_json যেকোনো এক্সেপশন দিতে পারে; ASGI অ্যাপ থেকে তা বের হতে দেওয়া হয় না
+        try: update = Update.de_json(data, application.bot)
+        except Exception: return await _plain_response(send, 400, b"bad update")
+        await application.update_queue.put(update)
+        await _plain_response(send, 200)
+
+    async def asgi(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == WEBHOOK_PATH and scope['method'] == 'POST':
+            return await telegram_webhook(scope, receive, send)
+        return await flask_asgi(scope, receive, send)
+    return asgi
+
+async def run_webhook(application):
+    import uvicorn
+    port = int(os.environ.get('PORT', 8080))
+    server = uvicorn.Server(uvicorn.Config(make_asgi_app(application), host='0.0.0.0', port=port, lifespan='off', log_level='warning'))
+    async with application:
+        await application.bot.set_webhook(
+            url=f"{os.environ.get('APP_URL')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS, allowed_updates=Update.ALL_TYPES
+        )
+        await application.start()
+        await on_startup(application)
+        await server.serve()
+        await application.stop()
+
 def run_flask():
+    # ডেভ সার্ভারের বদলে মাল্টি-থ্রেডেড waitress; আলাদা ওয়েব সার্ভিস হলে: gunicorn -w 4 -b 0.0.0.0:$PORT bot:app
     port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
+    serve(app, host='0.0.0.0', port=port, threads=int(os.environ.get('WEB_THREADS', 8)))
 
 # --- কনফিগ ---
 OWNER_ID = int(os.environ.get('OWNER_ID', 0))
@@ -69,7 +721,29 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 # কনভারসেশন স্টেটসমূহ
 NAME, POSTER, YEAR, LANGUAGE, QUALITY, LINK, CONFIRM_MORE = range(7)
-CH_NAME, CH_LINK, S_CLICK, S_ZONE, S_REDEEM, S_UNPREMIUM, S_ADD_PREM_VAL, S_GEN_CODE_VAL, S_SET_OFFER_VAL = range(7, 16)
+CH_NAME, CH_LINK, S_CLICK, S_ZONE, S_REDEEM, S_UNPREMIUM, S_ADD_PREM_VAL, S_GEN_CODE_VAL, S_SET_OFFER_VAL, S_REVOKE_BATCH, S_BC_AUDIENCE, S_BC_TEXT, S_BULK = range(7, 20)
+
+# রিডিম কোড জেনারেশন
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_INSERT_BATCH = 1000
+MAX_GEN_CODES = int(os.environ.get('MAX_GEN_CODES', 50000))
+INLINE_CODES_LIMIT = 20
+
+# প্রিমিয়াম মেয়াদ শিডিউলার ও নোটিফিকেশন
+EXPIRY_CHECK_INTERVAL = int(os.environ.get('EXPIRY_CHECK_INTERVAL', 600))
+EXPIRY_WARN_HOURS = int(os.environ.get('EXPIRY_WARN_HOURS', 24))
+EXPIRY_BATCH = 1000
+SEND_RATE = float(os.environ.get('SEND_RATE', 25))  # টেলিগ্রামের গ্লোবাল লিমিট ~৩০ মেসেজ/সেকেন্ড
+
+# ব্রডকাস্ট
+BROADCAST_BATCH = 500
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 20))
+BROADCAST_REPORT_INTERVAL = 5
+BULK_MAX_ROWS = 500
+OUTPUT_MODES = {"inline": "💬 মেসেজে (ইনলাইন)", "file": "📄 .html ফাইল", "min": "🗜 মিনিফাইড .html", "gzip": "📦 .html.gz"}
+INLINE_HTML_LIMIT = 4096
+BULK_MAX_BYTES = 2 * 1024 * 1024
+BULK_CONCURRENCY = 8
 
 # --- হেল্পার ফাংশন ---
 
@@ -90,20 +764,211 @@ def get_detailed_time_string(expiry_date):
     parts.append(f"{seconds} সেকেন্ড")
     return ", ".join(parts)
 
-async def is_authorized(user_id):
+def new_code():
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(10))
+
+def insert_codes(days, count, batch_id):
+    # insert_many দিয়ে ব্যাচে লেখে; ইউনিক ইনডেক্সে যেগুলো কলিশন করে শুধু সেগুলোর জন্য নতুন কোড বানিয়ে আবার চেষ্টা করে
+    now, done = datetime.datetime.now(), []
+    pending = [new_code() for _ in range(count)]
+    while pending:
+        chunk, pending = pending[:CODE_INSERT_BATCH], pending[CODE_INSERT_BATCH:]
+        try:
+            codes_col.insert_many([{"code": c, "days": days, "batch": batch_id, "created_at": now} for c in chunk], ordered=False)
+            done.extend(chunk)
+        except BulkWriteError as e:
+            errors = e.details['writeErrors']
+            if any(err['code'] != 11000 for err in errors): raise
+            dup = {err['index'] for err in errors}
+            done.extend(c for i, c in enumerate(chunk) if i not in dup)
+            pending.extend(new_code() for _ in dup)
+    return done
+
+def extend_premium(user_id, days):
+    # এক রাইটে max(এখন, বর্তমান মেয়াদ) থেকে মেয়াদ বাড়ায় (aggregation-pipeline আপডেট), নতুন মেয়াদ ফেরত দেয়
+    now = datetime.datetime.now()
+    doc = profiles_col.find_one_and_update(
+        {"user_id": user_id},
+        [{"$set": {"expiry_date": {"$add": [{"$max": ["$expiry_date", now]}, days * 86400000]}}}, {"$unset": "warned"}],
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc['expiry_date']
+
+async def redeem_code(user_id, code):
+    # find_one_and_delete অ্যাটমিক: একই কোড একসাথে অনেকে দিলেও শুধু একজনই পায়
+    data = await db_call(codes_col.find_one_and_delete, {"code": code})
+    if not data: return None
+    try: new_exp = await db_call(extend_premium, user_id, int(data['days']))
+    except Exception:
+        # মেয়াদ বাড়ানো না গেলে কোডটি ফেরত রাখা হয়, যাতে হারিয়ে না যায় আর ইউজার আবার চেষ্টা করতে পারে
+        await db_call(codes_col.insert_one, data)
+        raise
+    profile_cache.invalidate(user_id)
+    return new_exp
+
+def is_premium(user_id, profile):
     if user_id == OWNER_ID: return True
-    user = premium_col.find_one({"user_id": user_id})
-    if user:
-        if datetime.datetime.now() < user['expiry_date']: return True
-        else: premium_col.delete_one({"user_id": user_id})
-    return False
+    # মেয়াদোত্তীর্ণ মেয়াদ expiry_job মুছে দেয়, এখানে শুধু যাচাই
+    return bool(profile.get('expiry_date')) and datetime.datetime.now() < profile['expiry_date']
+
+MIGRATION_MARKER = "profiles_migration"
+
+def migrate_profiles():
+    # premium_users, settings, channels → profiles; নতুন ভার্সন ডিপ্লয়ের আগে একবারই চালাতে হয়।
+    # ডিপ্লয়ের পরে আবার চালালে পুরনো কালেকশনের বাসি ডেটা নতুন মেয়াদ/মুছে ফেলা চ্যানেলের উপর বসে যেত,
+    # তাই সফল রানের পরে bot_state এ মার্কার থাকে আর পরের রান কিছু না করে None দেয়। মাঝপথে ব্যর্থ হলে আবার চালানো যায়
+    try: state_col.update_one({"_id": MIGRATION_MARKER, "done_at": {"$exists": False}}, {"$set": {"kind": "migration", "started_at": datetime.datetime.now()}}, upsert=True)
+    except DuplicateKeyError: return None
+    counts = {}
+    sources = [
+        ("premium", premium_col.find({}, {"_id": 0, "user_id": 1, "expiry_date": 1, "warned": 1}), lambda d: {"$set": {k: v for k, v in d.items() if k != 'user_id'}}),
+        ("settings", settings_col.find({}, {"_id": 0}), lambda d: {"$set": {k: v for k, v in d.items() if k != 'user_id'}}),
+        ("channels", channels_col.aggregate([{"$group": {"_id": "$user_id", "channels": {"$push": {"_id": "$_id", "name": "$name", "url": "$url"}}}}, {"$project": {"_id": 0, "user_id": "$_id", "channels": 1}}]),
+         lambda d: {"$addToSet": {"channels": {"$each": d['channels']}}}),
+    ]
+    for name, cursor, make_update in sources:
+        ops = []
+        counts[name] = 0
+        for d in cursor:
+            if d.get('user_id') is None: continue
+            update = make_update(d)
+            if not any(update.values()): continue
+            ops.append(UpdateOne({"user_id": d['user_id']}, update, upsert=True))
+            if len(ops) >= 1000: profiles_col.bulk_write(ops, ordered=False); counts[name] += len(ops); ops = []
+        if ops: profiles_col.bulk_write(ops, ordered=False); counts[name] += len(ops)
+    state_col.update_one({"_id": MIGRATION_MARKER}, {"$set": {"done_at": datetime.datetime.now(), "counts": counts}})
+    return counts
+
+# --- রেট-লিমিটেড নোটিফিকেশন ---
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            # ঘুমের মধ্যে pause() সময় এগিয়ে দিতে পারে, তাই জেগে আবার দেখা হয়
+            while (delay := self._next - time.monotonic()) > 0: await asyncio.sleep(delay)
+            self._next = time.monotonic() + self.interval
+
+    def pause(self, seconds):
+        # RetryAfter এ সব সেন্ডার থামে, শুধু যে এরর পেয়েছে সে নয়
+        self._next = max(self._next, time.monotonic() + seconds)
+
+send_limiter = RateLimiter(SEND_RATE)
+notify_queue = asyncio.Queue()
+
+def retry_seconds(e):
+    ra = e.retry_after
+    return ra.total_seconds() if isinstance(ra, datetime.timedelta) else ra
+
+async def send_limited(bot, chat_id, text, **kwargs):
+    # গ্লোবাল রেট মেনে পাঠায়, RetryAfter এলে পুরো লিমিটার থামিয়ে আবার চেষ্টা করে; ব্লক/ভুল চ্যাটে False
+    while True:
+        await send_limiter.wait()
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return True
+        except RetryAfter as e: send_limiter.pause(retry_seconds(e) + 1)
+        except TelegramError as e:
+            logging.info(f"{chat_id} এ মেসেজ পাঠানো যায়নি: {e}")
+            return False
+
+def notify(chat_id, text):
+    notify_queue.put_nowait((chat_id, text))
+
+async def notify_worker(bot):
+    while True:
+        chat_id, text = await notify_queue.get()
+        try: await send_limited(bot, chat_id, text)
+        except Exception as e: logging.error(f"নোটিফিকেশন ব্যর্থ: {e}")
+        finally: notify_queue.task_done()
+
+# --- প্রিমিয়াম মেয়াদ শিডিউলার ---
+async def expiry_job(context: ContextTypes.DEFAULT_TYPE):
+    # expiry_date ইনডেক্স ধরে ব্যাচে খোঁজে: আগে ২৪ ঘণ্টার সতর্কতা, তারপর মেয়াদোত্তীর্ণদের মেয়াদ bulk unset
+    now = datetime.datetime.now()
+    soon_q = {"expiry_date": {"$gt": now, "$lte": now + datetime.timedelta(hours=EXPIRY_WARN_HOURS)}, "warned": {"$ne": True}}
+    while batch := await db_find(profiles_col, soon_q, {"user_id": 1, "expiry_date": 1}, limit=EXPIRY_BATCH):
+        await db_call(profiles_col.update_many, {"_id": {"$in": [d['_id'] for d in batch]}}, {"$set": {"warned": True}})
+        for d in batch: notify(d['user_id'], f"⏳ আপনার প্রিমিয়াম মেয়াদ শেষ হতে বাকি: {get_detailed_time_string(d['expiry_date'])}\n/redeem দিয়ে নবায়ন করুন।")
+
+    expired_q = {"expiry_date": {"$lte": now}}
+    removed = 0
+    while batch := await db_find(profiles_col, expired_q, {"user_id": 1}, limit=EXPIRY_BATCH):
+        # expiry_date শর্ত আবার দেওয়া হয় যাতে এর মধ্যে নবায়ন হওয়া ইউজারের মেয়াদ মুছে না যায়
+        ids = [d['_id'] for d in batch]
+        await db_call(profiles_col.update_many, {"_id": {"$in": ids}, **expired_q}, {"$unset": {"expiry_date": "", "warned": ""}})
+        # নোটিফিকেশন আর গণনা শুধু যাদের মেয়াদ সত্যিই মোছা হয়েছে তাদের জন্য
+        unset = await db_find(profiles_col, {"_id": {"$in": ids}, "expiry_date": {"$exists": False}}, {"user_id": 1})
+        for d in batch: profile_cache.invalidate(d['user_id'])
+        for d in unset: notify(d['user_id'], "🚫 আপনার প্রিমিয়াম মেয়াদ শেষ হয়েছে। /offers দেখে নবায়ন করুন।")
+        removed += len(unset)
+    if removed: logging.info(f"{removed}টি মেয়াদোত্তীর্ণ প্রিমিয়াম বাতিল (expiry_date unset) হয়েছে")
+
+async def compact_job(context: ContextTypes.DEFAULT_TYPE):
+    count, reclaimed = await db_call(compact_previews)
+    if count: logging.info(f"{count}টি প্রিভিউ আর্কাইভ হয়েছে, {reclaimed} বাইট খালি হয়েছে")
+
+# --- ব্রডকাস্ট ইঞ্জিন ---
+def broadcast_audience(bc):
+    if bc['audience'] == 'premium': return profiles_col, {"expiry_date": {"$gt": bc['started_at']}}
+    return users_col, {}
+
+async def report_broadcast(bot, bc, sent, failed, total, rate, done=False):
+    head = "✅ ব্রডকাস্ট শেষ" if done else "📣 ব্রডকাস্ট চলছে..."
+    text = f"{head}\n━━━━━━━━━━━━\n📤 পাঠানো: {sent}\n❌ ব্যর্থ: {failed}\n👥 মোট: {total}\n⚡ গতি: {rate:.1f} মেসেজ/সেকেন্ড"
+    try: await bot.edit_message_text(text, chat_id=bc['chat_id'], message_id=bc['message_id'])
+    except TelegramError: pass
+
+async def run_broadcast(bot, bc_id):
+    # user_id ক্রমে পাঠানো হয়; প্রতিটি চাঙ্ক শেষে cursor Mongo তে সেভ হয়, তাই রিস্টার্টের পর সেখান থেকেই আবার শুরু হয়
+    bc = await db_call(broadcasts_col.find_one, {"_id": bc_id})
+    col, base_q = broadcast_audience(bc)
+    sent, failed, cursor = bc['sent'], bc['failed'], bc['cursor']
+    total = await db_call(col.count_documents, base_q)
+    t0, done_now, last_report = time.monotonic(), 0, 0.0
+
+    async def send_one(uid):
+        return await send_limited(bot, uid, bc['text'])
+
+    while batch := await db_find(col, {**base_q, "user_id": {"$gt": cursor}}, {"user_id": 1}, sort=[("user_id", 1)], limit=BROADCAST_BATCH):
+        for i in range(0, len(batch), BROADCAST_CONCURRENCY):
+            chunk = batch[i:i + BROADCAST_CONCURRENCY]
+            results = await asyncio.gather(*(send_one(d['user_id']) for d in chunk))
+            ok = sum(results)
+            sent, failed, done_now, cursor = sent + ok, failed + len(chunk) - ok, done_now + len(chunk), chunk[-1]['user_id']
+            await db_call(broadcasts_col.update_one, {"_id": bc_id}, {"$set": {"cursor": cursor, "sent": sent, "failed": failed}})
+            if time.monotonic() - last_report >= BROADCAST_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                await report_broadcast(bot, bc, sent, failed, total, done_now / max(last_report - t0, 1e-6))
+
+    await db_call(broadcasts_col.update_one, {"_id": bc_id}, {"$set": {"status": "done", "finished_at": datetime.datetime.now()}})
+    await report_broadcast(bot, bc, sent, failed, total, done_now / max(time.monotonic() - t0, 1e-6), done=True)
+
+# ব্যাকগ্রাউন্ড টাস্কের রেফারেন্স রাখা হয় যাতে গার্বেজ-কালেক্ট না হয়
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def on_startup(application):
+    spawn(notify_worker(application.bot))
+    # রিস্টার্টের আগে অসমাপ্ত ব্রডকাস্ট আবার চালু
+    for bc in await db_find(broadcasts_col, {"status": "running"}, {"_id": 1}):
+        spawn(run_broadcast(application.bot, bc['_id']))
 
 def get_main_menu_keyboard(user_id):
     kb = [
         [InlineKeyboardButton("🎬 Create Movie Post", callback_data="start_post_btn"), InlineKeyboardButton("📊 My Status", callback_data="btn_status")],
         [InlineKeyboardButton("💎 Premium Offers", callback_data="btn_offers"), InlineKeyboardButton("🔑 Redeem Code", callback_data="start_redeem_btn")],
         [InlineKeyboardButton("⚙️ Click Limit", callback_data="start_click_btn"), InlineKeyboardButton("🔗 Monetag Zone", callback_data="start_zone_btn")],
-        [InlineKeyboardButton("📢 Channels", callback_data="btn_channels_list")]
+        [InlineKeyboardButton("📢 Channels", callback_data="btn_channels_list"), InlineKeyboardButton("📈 Post Stats", callback_data="btn_post_stats")],
+        [InlineKeyboardButton("📄 HTML Output", callback_data="btn_output"), InlineKeyboardButton("🗓 Retention", callback_data="btn_retention")]
     ]
     if user_id == OWNER_ID: kb.append([InlineKeyboardButton("🛠 Admin Panel", callback_data="btn_admin_panel")])
     return InlineKeyboardMarkup(kb)
@@ -112,6 +977,8 @@ def get_main_menu_keyboard(user_id):
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    # ব্রডকাস্টের জন্য পরিচিত ইউজারের তালিকা
+    await db_call(users_col.update_one, {"user_id": user.id}, {"$set": {"name": user.full_name}, "$setOnInsert": {"joined_at": datetime.datetime.now()}}, upsert=True)
     await update.message.reply_text(f"👋 হ্যালো {user.first_name}!\nআপনার বটের মেনু নিচে দেওয়া হলো:", reply_markup=get_main_menu_keyboard(user.id))
 
 async def menu_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -121,15 +988,15 @@ async def menu_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
 
     if query.data == "btn_status":
-        premium_user = premium_col.find_one({"user_id": user_id})
+        profile = await context.profile()
         if user_id == OWNER_ID: membership, expiry = "👑 ওনার (Owner)", "অনন্তকাল (♾️)"
-        elif premium_user: membership, expiry = "💎 প্রিমিয়াম", get_detailed_time_string(premium_user['expiry_date'])
+        elif profile.get('expiry_date'): membership, expiry = "💎 প্রিমিয়াম", get_detailed_time_string(profile['expiry_date'])
         else: membership, expiry = "👤 সাধারণ", "মেয়াদ নেই"
         status_msg = f"📊 **আপনার প্রোফাইল ডিটেইলস:**\n━━━━━━━━━━━━━━━━━━━━\n👤 **নাম:** {user.full_name}\n🆔 **আইডি:** `{user_id}`\n🌟 **মেম্বারশিপ:** {membership}\n⏳ **বাকি সময়:** {expiry}\n━━━━━━━━━━━━━━━━━━━━"
         await query.message.reply_text(status_msg, parse_mode=ParseMode.MARKDOWN)
 
     elif query.data == "btn_offers":
-        offers = list(offers_col.find())
+        offers = await get_offers()
         msg = "💎 **আমাদের প্রিমিয়াম অফারসমূহ:**\n\n"
         if not offers: msg += "বর্তমানে কোনো অফার নেই।"
         else:
@@ -138,9 +1005,8 @@ async def menu_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode=ParseMode.MARKDOWN)
 
     elif query.data == "btn_channels_list":
-        if not await is_authorized(user_id): return
-        chans = list(channels_col.find({"user_id": user_id}))
-        kb = [[InlineKeyboardButton(f"❌ {c['name']}", callback_data=f"delch_{c['_id']}")] for c in chans]
+        if not await context.is_authorized(): return
+        kb = [[InlineKeyboardButton(f"❌ {c['name']}", callback_data=f"delch_{c['_id']}")] for c in (await context.profile()).get('channels', [])]
         kb.append([InlineKeyboardButton("➕ Add New Channel", callback_data="start_addch_btn")])
         await query.message.reply_text("📢 আপনার চ্যানেলসমূহ:", reply_markup=InlineKeyboardMarkup(kb))
 
@@ -149,24 +1015,82 @@ async def menu_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
             admin_kb = [
                 [InlineKeyboardButton("➕ Add Premium", callback_data="start_add_prem_btn"), InlineKeyboardButton("🔑 Gen Code", callback_data="start_gen_code_btn")],
                 [InlineKeyboardButton("🏷 Set Offer", callback_data="start_set_offer_btn"), InlineKeyboardButton("❌ Remove Premium", callback_data="start_unpremium_btn")],
-                [InlineKeyboardButton("🗑 Delete Offer", callback_data="btn_del_offer_list")]
+                [InlineKeyboardButton("🗑 Delete Offer", callback_data="btn_del_offer_list"), InlineKeyboardButton("🚫 Revoke Batch", callback_data="start_revoke_batch_btn")],
+                [InlineKeyboardButton("📣 Broadcast", callback_data="start_broadcast_btn"), InlineKeyboardButton("📈 Cache Stats", callback_data="btn_cache_stats")],
+                [InlineKeyboardButton("🗜 Compact Previews", callback_data="btn_compact")]
             ]
             admin_msg = "🛠 **এডমিন প্যানেল:**\nনিচের বাটনগুলো ব্যবহার করে বট নিয়ন্ত্রণ করুন।"
             await query.message.reply_text(admin_msg, reply_markup=InlineKeyboardMarkup(admin_kb), parse_mode=ParseMode.MARKDOWN)
 
     elif query.data == "btn_del_offer_list":
         if user_id != OWNER_ID: return
-        offers = list(offers_col.find())
+        offers = await get_offers()
         if not offers: await query.message.reply_text("কোনো অফার নেই।"); return
         kb = [[InlineKeyboardButton(f"🗑 {o['title']}", callback_data=f"doff_{o['_id']}")] for o in offers]
         await query.message.reply_text("ডিলিট করতে অফার সিলেক্ট করুন:", reply_markup=InlineKeyboardMarkup(kb))
 
+    elif query.data == "btn_post_stats":
+        # প্রি-অ্যাগ্রিগেটেড ডকুমেন্ট থেকে পড়া হয়, কাঁচা ইভেন্ট স্ক্যান নয়
+        posts = await db_find(post_stats_col, {"user_id": user_id}, sort=[("_id", -1)], limit=10)
+        days = await db_find(daily_stats_col, {"user_id": user_id}, sort=[("day", -1)], limit=7)
+        if not posts: await query.message.reply_text("📈 এখনো কোনো ভিউ বা ক্লিক রেকর্ড হয়নি।"); return
+        msg = "📈 সাম্প্রতিক পোস্ট:\n"
+        for p in posts: msg += f"🎬 {p.get('name') or p['_id']}\n   👁 {p.get('views', 0)} | 🖱 {p.get('clicks', 0)} | 🔓 {p.get('unlocks', 0)}\n"
+        msg += "\n📅 দিনভিত্তিক মোট:\n"
+        for d in days: msg += f"{d['day']}: 👁 {d.get('views', 0)} | 🖱 {d.get('clicks', 0)} | 🔓 {d.get('unlocks', 0)}\n"
+        await query.message.reply_text(msg)
+
+    elif query.data == "btn_output":
+        mode = (await context.profile()).get('output_mode', 'inline')
+        kb = [[InlineKeyboardButton(("✅ " if m == mode else "") + label, callback_data=f"omode_{m}")] for m, label in OUTPUT_MODES.items()]
+        await query.message.reply_text("📄 পোস্টের HTML কীভাবে পাঠানো হবে?", reply_markup=InlineKeyboardMarkup(kb))
+
+    elif query.data.startswith("omode_"):
+        mode = query.data.split("_", 1)[1]
+        if mode not in OUTPUT_MODES: return
+        await update_profile(user_id, {"$set": {"output_mode": mode}})
+        await query.edit_message_text(f"✅ HTML আউটপুট: {OUTPUT_MODES[mode]}")
+
+    elif query.data == "btn_retention":
+        current = (await context.profile()).get('retention_days', 0)
+        kb = [[InlineKeyboardButton(("✅ " if d == current else "") + label, callback_data=f"ret_{d}")] for d, label in RETENTION_CHOICES.items()]
+        await query.message.reply_text("🗓 আপনার প্রিভিউ লিংক কতদিন থাকবে?", reply_markup=InlineKeyboardMarkup(kb))
+
+    elif query.data.startswith("ret_"):
+        days = int(query.data.split("_")[1])
+        if days not in RETENTION_CHOICES: return
+        await update_profile(user_id, {"$set": {"retention_days": days}})
+        # আগের প্রিভিউর মেয়াদ শুধু বাড়ে, কখনো কমে না: কম দিন বাছলে পুরনো/শেয়ার করা লিংক TTL এ সাথে সাথে মুছে যেত।
+        # কম মেয়াদ শুধু এখন থেকে তৈরি প্রিভিউতে খাটে
+        if days: await db_call(previews_col.update_many, {"user_id": user_id, "expires_at": {"$ne": None}}, [{"$set": {"expires_at": {"$max": ["$expires_at", {"$add": ["$created_at", days * 86400000]}]}}}])
+        else: await db_call(previews_col.update_many, {"user_id": user_id}, {"$set": {"expires_at": None}})
+        await query.edit_message_text(f"✅ প্রিভিউ রাখা হবে: {RETENTION_CHOICES[days]}\nℹ️ আগের প্রিভিউর মেয়াদ কমানো হয় না, নতুন মেয়াদ এখন থেকে তৈরি প্রিভিউতে খাটবে।")
+
+    elif query.data == "btn_compact":
+        if user_id != OWNER_ID: return
+        count, reclaimed = await db_call(compact_previews)
+        await query.message.reply_text(f"🗜 {count}টি পুরনো প্রিভিউ আর্কাইভ হয়েছে, {reclaimed / 1024:.1f} KB খালি হয়েছে।")
+
+    elif query.data.startswith("phtml_"):
+        doc = await db_call(previews_col.find_one, {"_id": ObjectId(query.data.split("_")[1]), "user_id": user_id})
+        if not doc: await query.message.reply_text("❌ পোস্টটি পাওয়া যায়নি।"); return
+        await send_post_html(query.message, await context.profile(), render_preview(doc), doc['name'])
+
+    elif query.data == "btn_cache_stats":
+        if user_id != OWNER_ID: return
+        lines = []
+        for name, c in (("Profile", profile_cache), ("Offers", offers_cache)):
+            st = c.stats()
+            lines.append(f"• {name}: hit {st['hits']} | miss {st['misses']} | {st['hit_rate']:.0%} | size {st['size']}")
+        await query.message.reply_text("📈 ক্যাশ পরিসংখ্যান:\n" + "\n".join(lines))
+
     elif query.data.startswith("delch_"):
-        channels_col.delete_one({"_id": ObjectId(query.data.split("_")[1])})
+        await update_profile(user_id, {"$pull": {"channels": {"_id": ObjectId(query.data.split("_")[1])}}})
         await query.edit_message_text("✅ চ্যানেল ডিলিট হয়েছে।")
 
     elif query.data.startswith("doff_"):
-        offers_col.delete_one({"_id": ObjectId(query.data.split("_")[1])})
+        await db_call(offers_col.delete_one, {"_id": ObjectId(query.data.split("_")[1])})
+        offers_cache.invalidate()
         await query.edit_message_text("✅ প্রিমিয়াম অফারটি ডিলিট হয়েছে।")
 
 # --- এডমিন বাটন প্রসেস (নতুনভাবে যুক্ত করা হলো) ---
@@ -182,7 +1106,7 @@ async def save_add_prem(update: Update, context: ContextTypes.DEFAULT_TYPE):
         args = update.message.text.split()
         uid, days = int(args[0]), int(args[1])
         expiry = datetime.datetime.now() + datetime.timedelta(days=days)
-        premium_col.update_one({"user_id": uid}, {"$set": {"expiry_date": expiry}}, upsert=True)
+        await update_profile(uid, {"$set": {"expiry_date": expiry}, "$unset": {"warned": ""}})
         time_text = get_detailed_time_string(expiry)
         await update.message.reply_text(f"✅ ইউজার {uid} প্রিমিয়াম করা হয়েছে।\n⏳ মেয়াদ: {time_text}")
         try: await context.bot.send_message(chat_id=uid, text=f"🎉 **অভিনন্দন! এডমিন আপনাকে প্রিমিয়াম মেম্বারশিপ দিয়েছেন।**\n\n⏳ **আপনার মোট সময়:** {time_text}", parse_mode=ParseMode.MARKDOWN)
@@ -200,13 +1124,40 @@ async def save_gen_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         args = update.message.text.split()
         days, count = int(args[0]), int(args[1])
-        codes = []
-        for _ in range(count):
-            c = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-            codes_col.insert_one({"code": c, "days": days})
-            codes.append(f"`{c}`")
-        await update.message.reply_text(f"✅ {days} দিনের {count}টি কোড তৈরি:\n\n" + "\n".join(codes), parse_mode=ParseMode.MARKDOWN)
-    except: await update.message.reply_text("❌ ভুল ফরম্যাট। সঠিক উদাহরণ: `30 5`")
+        if not 0 < count <= MAX_GEN_CODES: raise ValueError
+    except:
+        await update.message.reply_text(f"❌ ভুল ফরম্যাট। সঠিক উদাহরণ: `30 5` (সর্বোচ্চ {MAX_GEN_CODES}টি কোড)", parse_mode=ParseMode.MARKDOWN)
+        return ConversationHandler.END
+    batch_id = f"{datetime.datetime.now():%y%m%d}-{secrets.token_hex(3).upper()}"
+    try: codes = await db_call(insert_codes, days, count, batch_id)
+    except Exception as e:
+        # আগের চাঙ্কগুলো ইতিমধ্যে সেভ হয়ে থাকতে পারে; ব্যাচ আইডি জানালে Revoke Batch দিয়ে বাতিল করা যায়
+        logging.error(f"কোড ব্যাচ {batch_id} তৈরি মাঝপথে ব্যর্থ: {str(e)[:300]}")
+        try: saved = await db_call(codes_col.count_documents, {"batch": batch_id})
+        except Exception: saved = "?"
+        await update.message.reply_text(
+            f"⚠️ কোড তৈরি মাঝপথে ব্যর্থ হয়েছে।\n🏷 ব্যাচ আইডি: `{batch_id}`\n💾 সেভ হয়েছে: {saved}/{count}টি কোড\n"
+            "এগুলো বাতিল করতে 🚫 Revoke Batch এ এই আইডি দিন।", parse_mode=ParseMode.MARKDOWN)
+        return ConversationHandler.END
+    caption = f"✅ {days} দিনের {len(codes)}টি কোড তৈরি।\n🏷 ব্যাচ আইডি: `{batch_id}`"
+    if len(codes) <= INLINE_CODES_LIMIT:
+        await update.message.reply_text(caption + "\n\n" + "\n".join(f"`{c}`" for c in codes), parse_mode=ParseMode.MARKDOWN)
+    else:
+        csv_data = "code,days,batch\n" + "".join(f"{c},{days},{batch_id}\n" for c in codes)
+        await update.message.reply_document(document=io.BytesIO(csv_data.encode()), filename=f"codes_{batch_id}.csv", caption=caption, parse_mode=ParseMode.MARKDOWN)
+    return ConversationHandler.END
+
+# ২.১ কোড ব্যাচ বাতিল
+async def start_revoke_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    await update.callback_query.message.reply_text("🚫 যে ব্যাচের সব অব্যবহৃত কোড বাতিল করবেন তার **ব্যাচ আইডি** দিন:", parse_mode=ParseMode.MARKDOWN)
+    return S_REVOKE_BATCH
+
+async def save_revoke_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    batch_id = update.message.text.strip()
+    res = await db_call(codes_col.delete_many, {"batch": batch_id})
+    if res.deleted_count > 0: await update.message.reply_text(f"✅ ব্যাচ `{batch_id}` এর {res.deleted_count}টি কোড বাতিল হয়েছে।", parse_mode=ParseMode.MARKDOWN)
+    else: await update.message.reply_text("❌ এই ব্যাচে কোনো অব্যবহৃত কোড নেই।")
     return ConversationHandler.END
 
 # ৩. অফার সেট বাটন
@@ -218,7 +1169,8 @@ async def start_set_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def save_set_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         data = update.message.text.split("|")
-        offers_col.insert_one({"title": data[0].strip(), "price": data[1].strip(), "days": data[2].strip()})
+        await db_call(offers_col.insert_one, {"title": data[0].strip(), "price": data[1].strip(), "days": data[2].strip()})
+        offers_cache.invalidate()
         await update.message.reply_text("✅ নতুন অফার যুক্ত হয়েছে।")
     except: await update.message.reply_text("❌ ভুল ফরম্যাট। সঠিক উদাহরণ: `মাসে ১ বার | ১০০ টাকা | ৩০`")
     return ConversationHandler.END
@@ -232,8 +1184,9 @@ async def start_unpremium(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def save_unpremium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         uid = int(update.message.text)
-        res = premium_col.delete_one({"user_id": uid})
-        if res.deleted_count > 0:
+        res = await db_call(profiles_col.update_one, {"user_id": uid, "expiry_date": {"$exists": True}}, {"$unset": {"expiry_date": "", "warned": ""}})
+        profile_cache.invalidate(uid)
+        if res.modified_count > 0:
             await update.message.reply_text(f"✅ ইউজার `{uid}` এখন থেকে আর প্রিমিয়াম মেম্বার নন।")
             try: await context.bot.send_message(uid, "🚫 এডমিন আপনার প্রিমিয়াম সাবস্ক্রিপশন বাতিল করেছেন।")
             except: pass
@@ -241,9 +1194,34 @@ async def save_unpremium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except: await update.message.reply_text("❌ সঠিক আইডি দিন।")
     return ConversationHandler.END
 
+# ৫. ব্রডকাস্ট
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    if update.effective_user.id != OWNER_ID: return ConversationHandler.END
+    kb = [[InlineKeyboardButton("💎 প্রিমিয়াম ইউজার", callback_data="bc_premium"), InlineKeyboardButton("👥 সব ইউজার", callback_data="bc_all")]]
+    await update.callback_query.message.reply_text("📣 কাদের কাছে মেসেজ পাঠাবেন?", reply_markup=InlineKeyboardMarkup(kb))
+    return S_BC_AUDIENCE
+
+async def pick_bc_audience(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data['bc_audience'] = query.data.split("_")[1]
+    await query.edit_message_text("✍️ ব্রডকাস্ট মেসেজটি লিখুন:")
+    return S_BC_TEXT
+
+async def save_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    status = await update.message.reply_text("📣 ব্রডকাস্ট শুরু হচ্ছে...")
+    bc = {
+        "text": update.message.text, "audience": context.user_data.pop('bc_audience', 'premium'), "status": "running",
+        "cursor": 0, "sent": 0, "failed": 0, "chat_id": status.chat_id, "message_id": status.message_id, "started_at": datetime.datetime.now()
+    }
+    bc_id = (await db_call(broadcasts_col.insert_one, bc)).inserted_id
+    spawn(run_broadcast(context.bot, bc_id))
+    return ConversationHandler.END
+
 # --- মুভি পোস্ট প্রসেস ---
 async def start_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_authorized(update.effective_user.id):
+    if not await context.is_authorized():
         msg = "🚫 প্রিমিয়াম সাবস্ক্রিপশন প্রয়োজন। /offers লিখে অফার দেখুন।"
         if update.callback_query: await update.callback_query.message.reply_text(msg)
         else: await update.message.reply_text(msg)
@@ -260,7 +1238,17 @@ async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return POSTER
 
 async def get_poster(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['poster'] = update.message.text
+    url = update.message.text.strip()
+    try: poster_hash = await ingest_poster_async(url)
+    except ConnectionError as e:
+        # লিংক ঠিক আছে কিন্তু এখন আনা যাচ্ছে না: পোস্ট আটকে না রেখে পেজে আসল URL থেকেই ছবি দেখানো হয়
+        logging.info(f"পোস্টার এখন আনা যায়নি, সরাসরি লিংক ব্যবহার হবে ({url}): {e}")
+        poster_hash = None
+    except Exception as e:
+        logging.info(f"পোস্টার আনা যায়নি ({url}): {e}")
+        await update.message.reply_text("❌ ছবিটি আনা যায়নি। সরাসরি ইমেজ লিংক (jpg/png/webp) দিন:")
+        return POSTER
+    context.user_data['poster'], context.user_data['poster_hash'] = url, poster_hash
     await update.message.reply_text("📅 মুভির সাল (Year) লিখুন (যেমন: 2024):")
     return YEAR
 
@@ -285,6 +1273,36 @@ async def get_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("যুক্ত হয়েছে। আরও কোয়ালিটি যোগ করবেন?", reply_markup=InlineKeyboardMarkup(kb))
     return CONFIRM_MORE
 
+def build_preview_doc(uid, post, profile):
+    now, days = datetime.datetime.now(), profile.get('retention_days')
+    doc = {
+        "user_id": uid, "name": post['name'], "poster": post['poster'], "poster_hash": post.get('poster_hash'), "year": post['year'], "lang": post['lang'], "items": post['items'],
+        "settings": {"click_limit": profile.get('click_limit', 1), "monetag_link": profile.get('monetag_link', "#")},
+        "channels": [{"name": c['name'], "url": c['url']} for c in profile.get('channels', [])],
+        "created_at": now, "expires_at": now + datetime.timedelta(days=days) if days else None
+    }
+    doc['content_hash'] = preview_content_hash(doc)
+    return doc
+
+async def send_post_html(message, profile, page, name):
+    # ইউজারের output_mode অনুযায়ী; ইনলাইন টেক্সট টেলিগ্রামের সীমা ছাড়ালে ফাইল হিসেবে যায়
+    mode = profile.get('output_mode', 'inline')
+    if mode == "inline" and len(page) <= INLINE_HTML_LIMIT:
+        return await message.reply_text(f"<pre><code>{html.escape(page)}</code></pre>", parse_mode=ParseMode.HTML)
+    filename = re.sub(r'[^\w-]+', '_', name).strip('_')[:40] or "post"
+    # mtime=0: gzip হেডারে সময় না বসলে একই পেজের বাইট (আর sent_files কি) প্রতিবার একই থাকে
+    if mode == "gzip": data, filename = gzip.compress(page.encode('utf-8'), 9, mtime=0), f"{filename}.html.gz"
+    else: data, filename = (minify_html(page) if mode == "min" else page).encode('utf-8'), f"{filename}.html"
+    # একই কনটেন্ট আগে আপলোড হয়ে থাকলে file_id দিয়ে পাঠানো হয়, আবার আপলোড নয়
+    key = f"{hashlib.sha256(data).hexdigest()}:{filename}"
+    known = await db_call(sent_files_col.find_one, {"_id": key})
+    if known:
+        try: return await message.reply_document(document=known['file_id'])
+        except TelegramError: pass
+    sent = await message.reply_document(document=io.BytesIO(data), filename=filename)
+    await db_call(sent_files_col.update_one, {"_id": key}, {"$set": {"file_id": sent.document.file_id, "created_at": datetime.datetime.now()}}, upsert=True)
+    return sent
+
 async def post_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -292,51 +1310,101 @@ async def post_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("💿 পরবর্তী কোয়ালিটি লিখুন:")
         return QUALITY
     elif query.data == "done_q_c":
-        uid, data = update.effective_user.id, context.user_data
-        setts = settings_col.find_one({"user_id": uid}) or {"monetag_link": "#", "click_limit": 1}
-        chans = list(channels_col.find({"user_id": uid}))
-        ch_html = "".join([f'<a href="{c["url"]}" style="background:#333;color:#fff;padding:5px 10px;margin:2px;text-decoration:none;border-radius:3px;font-size:12px;display:inline-block;">{c["name"]}</a>' for c in chans])
-        btns_html = "".join([f'<div style="margin-bottom: 10px;"><button class="dl-btn" onclick="processClick(\'{i["l"]}\')" style="background:#d9534f;color:#fff;padding:12px 20px;border:none;border-radius:5px;font-weight:bold;width:100%;cursor:pointer;">📥 Download {i["q"]}</button></div>' for i in data['items']])
-
-        raw_html = f"""
-<!DOCTYPE html><html><head><meta name="viewport" content="width=device-width, initial-scale=1.0"></head><body style="background:#f4f4f4; display:flex; justify-content:center; padding:20px;">
-<div style="text-align:center;border:2px solid #eee;padding:20px;border-radius:15px;font-family:sans-serif;max-width:450px;width:100%;background:#fff;box-shadow:0 5px 15px rgba(0,0,0,0.1);">
-    <img src="{data['poster']}" style="width:100%;border-radius:10px;margin-bottom:15px;" />
-    <h2 style="color:#222;margin:5px 0;">{data['name']} ({data['year']})</h2>
-    <p style="color:#555;margin-bottom:15px;"><b>Language:</b> {data['lang']}</p>
-    <div style="background:#f9f9f9;padding:15px;border-radius:10px;border:1px dashed #ccc;margin-bottom:15px;">
-        <p id="counter-text" style="font-weight:bold;color:#d9534f;margin-bottom:10px;">Steps: 0 / {setts['click_limit']}</p>
-        <div style="width: 100%; background: #ddd; height: 8px; border-radius: 5px; margin-bottom: 15px; overflow: hidden;">
-            <div id="progress-bar" style="width: 0%; background: #d9534f; height: 100%; transition: 0.3s;"></div>
-        </div>
-        {btns_html}
-    </div>
-    <div style="margin-top:10px;">{ch_html}</div>
-</div>
-<script>
-let clicks = 0; const limit = {setts['click_limit']}; const adUrl = "{setts['monetag_link']}";
-function processClick(finalUrl) {{
-    if (clicks < limit) {{ window.open(adUrl, "_blank"); clicks++;
-        document.getElementById('progress-bar').style.width = (clicks/limit)*100 + "%";
-        document.getElementById('counter-text').innerText = "Steps: " + clicks + " / " + limit;
-        if (clicks >= limit) {{
-            document.querySelectorAll('.dl-btn').forEach(b => {{ b.style.background = "#28a745"; b.innerText = b.innerText.replace("Download", "Get Link"); }});
-            document.getElementById('counter-text').style.color = "#28a745"; document.getElementById('counter-text').innerText = "Link Unlocked!";
-        }}
-    }} else {{ window.location.href = finalUrl; }}
-}}
-</script></body></html>"""
-        
-        p_id = previews_col.insert_one({"html": raw_html}).inserted_id
+        uid, profile = update.effective_user.id, await context.profile()
+        doc = build_preview_doc(uid, context.user_data, profile)
+        doc = (await db_call(save_previews, uid, [doc]))[doc['content_hash']]
+        p_id = doc['_id']
+        raw_html = render_preview(doc)
+        preview_cache.set(str(p_id), make_page_entry(raw_html, doc))
         p_url = f"{os.environ.get('APP_URL')}/preview/{p_id}"
-        kb = [[InlineKeyboardButton("👁️ Live Preview Link", url=p_url)]]
+        kb = [[InlineKeyboardButton("👁️ Live Preview Link", url=p_url)], [InlineKeyboardButton("📄 HTML আবার পাঠান", callback_data=f"phtml_{p_id}")]]
         await query.message.reply_text("✅ পোস্ট তৈরি হয়েছে!\nনিচের লিংকে ক্লিক করে প্রিভিউ দেখুন এবং কোডটি কপি করুন।", reply_markup=InlineKeyboardMarkup(kb))
-        await query.message.reply_text(f"<pre><code>{html.escape(raw_html)}</code></pre>", parse_mode=ParseMode.HTML)
+        await send_post_html(query.message, profile, raw_html, doc['name'])
         return ConversationHandler.END
 
+# ১.১ বাল্ক পোস্ট (CSV/JSON ফাইল থেকে একসাথে অনেক মুভি)
+def parse_bulk_rows(raw, filename):
+    # JSON: [{name, poster, year, lang, items: [{q, l}]}]
+    # CSV: name,poster,year,lang,quality,link — একই name+year এর সারিগুলো এক পোস্টের কোয়ালিটি হয়
+    text = raw.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        rows = json.loads(text)
+        if not isinstance(rows, list): raise ValueError("JSON must be a list")
+        return [(i + 1, r) for i, r in enumerate(rows)]
+    posts = {}
+    for line, r in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+        key = ((r.get('name') or '').strip(), (r.get('year') or '').strip())
+        _, post = posts.setdefault(key, (line, {"name": key[0], "year": key[1], "poster": r.get('poster'), "lang": r.get('lang'), "items": []}))
+        post['items'].append({"q": r.get('quality'), "l": r.get('link')})
+    return list(posts.values())
+
+def validate_bulk_row(row):
+    if not isinstance(row, dict): return None, "সারিটি অবজেক্ট নয়"
+    post = {k: str(row.get(k) or '').strip() for k in ('name', 'poster', 'year', 'lang')}
+    missing = [k for k, v in post.items() if not v]
+    if missing: return None, f"ফাঁকা ঘর: {', '.join(missing)}"
+    items = [{"q": str(i.get('q') or i.get('quality') or '').strip(), "l": str(i.get('l') or i.get('link') or '').strip()} for i in row.get('items') or [] if isinstance(i, dict)]
+    if not items or any(not i['q'] or not i['l'].startswith(('http://', 'https://')) for i in items): return None, "কোয়ালিটি/লিংক ভুল"
+    post['items'] = items
+    return post, None
+
+async def start_bulkpost(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await context.is_authorized():
+        await update.message.reply_text("🚫 প্রিমিয়াম সাবস্ক্রিপশন প্রয়োজন। /offers লিখে অফার দেখুন।")
+        return ConversationHandler.END
+    await update.message.reply_text(
+        f"📦 মুভির তালিকা CSV বা JSON ফাইল হিসেবে পাঠান (সর্বোচ্চ {BULK_MAX_ROWS}টি)।\n\n"
+        "CSV কলাম: `name,poster,year,lang,quality,link` (প্রতিটি কোয়ালিটি আলাদা সারিতে)\n"
+        "JSON: `[{\"name\": …, \"poster\": …, \"year\": …, \"lang\": …, \"items\": [{\"q\": \"720p\", \"l\": \"https://…\"}]}]`",
+        parse_mode=ParseMode.MARKDOWN)
+    return S_BULK
+
+async def save_bulkpost(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid, document = update.effective_user.id, update.message.document
+    if document.file_size and document.file_size > BULK_MAX_BYTES:
+        await update.message.reply_text("❌ ফাইল অনেক বড়।")
+        return ConversationHandler.END
+    raw = bytes(await (await document.get_file()).download_as_bytearray())
+    try: rows = parse_bulk_rows(raw, document.file_name or '')
+    except (ValueError, csv.Error) as e:
+        await update.message.reply_text(f"❌ ফাইল পড়া যায়নি: {e}")
+        return ConversationHandler.END
+    if not 0 < len(rows) <= BULK_MAX_ROWS:
+        await update.message.reply_text(f"❌ ফাইলে ১ থেকে {BULK_MAX_ROWS}টি মুভি থাকতে হবে।")
+        return ConversationHandler.END
+    await update.message.reply_text(f"⏳ {len(rows)}টি মুভি প্রসেস হচ্ছে...")
+
+    profile = await context.profile()
+    loop, sem = asyncio.get_running_loop(), asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def prepare(line, row):
+        # যাচাই → পোস্টার; রেন্ডার হয় সেভের পরে কারণ পেজে প্রিভিউর _id (বিকন URL) লাগে
+        post, err = validate_bulk_row(row)
+        if err: return line, None, err
+        async with sem:
+            try: post['poster_hash'] = await ingest_poster_async(post['poster'])
+            except ConnectionError: post['poster_hash'] = None
+            except Exception: return line, None, "পোস্টার আনা যায়নি"
+        return line, build_preview_doc(uid, post, profile), None
+
+    results = await asyncio.gather(*(prepare(line, row) for line, row in rows))
+    docs = [doc for _, doc, _ in results if doc]
+    # বাল্ক পোস্ট preview_cache এ রাখা হয় না, যাতে হট পেজগুলো বের না হয়ে যায়
+    saved = await db_call(save_previews, uid, docs) if docs else {}
+    created = [(line, saved[doc['content_hash']]) for line, doc, _ in results if doc]
+    pages = await asyncio.gather(*(loop.run_in_executor(None, render_preview, doc) for _, doc in created))
+    base_url = os.environ.get('APP_URL')
+    summary = {
+        "created": [{"line": line, "name": doc['name'], "year": doc.get('year'), "preview_url": f"{base_url}/preview/{doc['_id']}", "html": page} for (line, doc), page in zip(created, pages)],
+        "errors": [{"line": line, "error": err} for line, _, err in results if err]
+    }
+    caption = f"✅ {len(summary['created'])}টি পোস্ট তৈরি হয়েছে।" + (f"\n⚠️ {len(summary['errors'])}টি সারি বাদ পড়েছে (ফাইলের errors অংশ দেখুন)।" if summary['errors'] else "")
+    await update.message.reply_document(document=io.BytesIO(json.dumps(summary, ensure_ascii=False, indent=1).encode()), filename=f"bulkpost_{datetime.datetime.now():%y%m%d%H%M%S}.json", caption=caption)
+    return ConversationHandler.END
+
 # ২. ক্লিক সেটিংস
 async def start_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_authorized(update.effective_user.id): return ConversationHandler.END
+    if not await context.is_authorized(): return ConversationHandler.END
     text = "🔢 কতটি ক্লিক বা অ্যাড দেখাবে? (সংখ্যা দিন):"
     if update.callback_query: await update.callback_query.message.reply_text(text)
     else: await update.message.reply_text(text)
@@ -345,27 +1413,27 @@ async def start_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def save_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         val = int(update.message.text)
-        settings_col.update_one({"user_id": update.effective_user.id}, {"$set": {"click_limit": val}}, upsert=True)
+        await update_profile(update.effective_user.id, {"$set": {"click_limit": val}})
         await update.message.reply_text(f"✅ সফলভাবে {val}টি ক্লিক সেট হয়েছে।")
     except: await update.message.reply_text("❌ শুধু সংখ্যা দিন।")
     return ConversationHandler.END
 
 # ৩. জোন সেটিংস
 async def start_zone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_authorized(update.effective_user.id): return ConversationHandler.END
+    if not await context.is_authorized(): return ConversationHandler.END
     text = "🔗 আপনার Monetag Direct Link দিন:"
     if update.callback_query: await update.callback_query.message.reply_text(text)
     else: await update.message.reply_text(text)
     return S_ZONE
 
 async def save_zone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    settings_col.update_one({"user_id": update.effective_user.id}, {"$set": {"monetag_link": update.message.text}}, upsert=True)
+    await update_profile(update.effective_user.id, {"$set": {"monetag_link": update.message.text}})
     await update.message.reply_text("✅ মনিটেগ জোন সফলভাবে সেভ হয়েছে।")
     return ConversationHandler.END
 
 # ৪. চ্যানেল অ্যাড
 async def start_addch(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_authorized(update.effective_user.id): return ConversationHandler.END
+    if not await context.is_authorized(): return ConversationHandler.END
     text = "📢 চ্যানেলের নাম দিন:"
     if update.callback_query: await update.callback_query.message.reply_text(text)
     else: await update.message.reply_text(text)
@@ -377,7 +1445,7 @@ async def save_ch_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CH_LINK
 
 async def save_ch_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    channels_col.insert_one({"user_id": update.effective_user.id, "name": context.user_data['temp_cn'], "url": update.message.text})
+    await update_profile(update.effective_user.id, {"$push": {"channels": {"_id": ObjectId(), "name": context.user_data['temp_cn'], "url": update.message.text}}})
     await update.message.reply_text("✅ চ্যানেল সেভ হয়েছে।")
     return ConversationHandler.END
 
@@ -389,15 +1457,12 @@ async def start_redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return S_REDEEM
 
 async def save_redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    code = update.message.text
-    data = codes_col.find_one({"code": code})
-    if data:
-        uid = update.effective_user.id
-        cur = premium_col.find_one({"user_id": uid})
-        base = cur['expiry_date'] if cur and cur['expiry_date'] > datetime.datetime.now() else datetime.datetime.now()
-        new_exp = base + datetime.timedelta(days=int(data['days']))
-        premium_col.update_one({"user_id": uid}, {"$set": {"expiry_date": new_exp}}, upsert=True)
-        codes_col.delete_one({"code": code})
+    try: new_exp = await redeem_code(update.effective_user.id, update.message.text.strip())
+    except Exception as e:
+        logging.error(f"রিডিম ব্যর্থ ({update.effective_user.id}): {e}")
+        await update.message.reply_text("⚠️ সাময়িক সমস্যা হয়েছে, কোডটি এখনো বৈধ আছে। একটু পরে আবার চেষ্টা করুন।")
+        return ConversationHandler.END
+    if new_exp:
         await update.message.reply_text(f"🎉 সফল! আপনার প্রিমিয়াম এক্টিভেট হয়েছে।\n⏳ নতুন মেয়াদ: {get_detailed_time_string(new_exp)}")
     else: await update.message.reply_text("❌ ভুল বা ব্যবহৃত কোড।")
     return ConversationHandler.END
@@ -406,18 +1471,95 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("বাতিল হয়েছে।", reply_markup=get_main_menu_keyboard(update.effective_user.id))
     return ConversationHandler.END
 
-# --- মেইন রানার ---
-if __name__ == '__main__':
-    TOKEN = os.environ.get('BOT_TOKEN')
-    threading.Thread(target=run_flask, daemon=True).start()
-    threading.Thread(target=keep_alive, daemon=True).start()
-    bot_app = ApplicationBuilder().token(TOKEN).build()
+# --- কনভারসেশন পারসিস্টেন্স ---
+# কনভারসেশন স্টেট আর user_data Mongo তে থাকে, তাই রিডিপ্লয়ে অর্ধেক বানানো পোস্ট হারায় না।
+# PTB প্রতি update_interval এ পরিবর্তিত এন্ট্রিগুলো দেয়; সেগুলো মেমোরিতে জমে একটি bulk_write এ ফ্লাশ হয়।
+PERSISTENCE_INTERVAL = int(os.environ.get('PERSISTENCE_INTERVAL', 30))
+PERSISTENCE_FLUSH_DELAY = 1
+
+class MongoPersistence(BasePersistence):
+    def __init__(self, col, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False), update_interval=update_interval)
+        self.col = col
+        self._dirty = {}
+        self._flush_task = None
+
+    @staticmethod
+    def _conv_id(name, key):
+        return f"conv:{name}:{json.dumps(list(key))}"
+
+    def _mark(self, _id, doc):
+        # doc None মানে মুছে ফেলা
+        self._dirty[_id] = doc
+        if not self._flush_task or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # একই রানে আসা সব update_* কল একসাথে জমার জন্য সামান্য অপেক্ষা
+        await asyncio.sleep(PERSISTENCE_FLUSH_DELAY)
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        if not self._dirty: return
+        dirty, self._dirty = self._dirty, {}
+        now = datetime.datetime.now()
+        ops = [DeleteOne({"_id": _id}) if doc is None else ReplaceOne({"_id": _id}, {**doc, "updated_at": now}, upsert=True) for _id, doc in dirty.items()]
+        try: await db_call(self.col.bulk_write, ops, ordered=False)
+        except Exception as e:
+            logging.error(f"পারসিস্টেন্স ফ্লাশ ব্যর্থ: {e}")
+            for _id, doc in dirty.items(): self._dirty.setdefault(_id, doc)
+
+    async def get_user_data(self):
+        docs = await db_find(self.col, {"kind": "user"})
+        return {d['user_id']: d['data'] for d in docs}
+
+    async def get_conversations(self, name):
+        docs = await db_find(self.col, {"kind": "conv", "name": name})
+        return {tuple(d['key']): d['state'] for d in docs}
+
+    async def update_user_data(self, user_id, data):
+        self._mark(f"user:{user_id}", {"kind": "user", "user_id": user_id, "data": data})
+
+    async def update_conversation(self, name, key, new_state):
+        _id = self._conv_id(name, key)
+        self._mark(_id, None if new_state is None else {"kind": "conv", "name": name, "key": list(key), "state": new_state})
+
+    async def drop_user_data(self, user_id):
+        self._mark(f"user:{user_id}", None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # প্রতি আপডেটে রিলোড করলে একটি রাউন্ড ট্রিপ বাড়ে, তাই মেমোরির কপিই ব্যবহার হয়
+        pass
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done(): self._flush_task.cancel()
+        await self._write_dirty()
+
+    # chat_data, bot_data, callback_data এই বট ব্যবহার করে না
+    async def get_chat_data(self): return {}
+    async def get_bot_data(self): return {}
+    async def get_callback_data(self): return None
+    async def update_chat_data(self, chat_id, data): pass
+    async def update_bot_data(self, data): pass
+    async def update_callback_data(self, data): pass
+    async def drop_chat_data(self, chat_id): pass
+    async def refresh_chat_data(self, chat_id, chat_data): pass
+    async def refresh_bot_data(self, bot_data): pass
+
+# --- হ্যান্ডলার রেজিস্ট্রেশন ---
+def build_application(token, request=None):
+    builder = ApplicationBuilder().token(token).context_types(ContextTypes(context=BotContext)).persistence(MongoPersistence(state_col)).post_init(on_startup).concurrent_updates(CONCURRENT_UPDATES)
+    if request: builder = builder.request(request)
+    elif METRICS_ENABLED: builder = builder.request(TimedRequest())
+    bot_app = builder.build()
+    bot_app.job_queue.run_repeating(expiry_job, interval=EXPIRY_CHECK_INTERVAL, first=30)
+    bot_app.job_queue.run_repeating(compact_job, interval=COMPACT_INTERVAL, first=600)
 
     # সাধারণ কমান্ড
     bot_app.add_handler(CommandHandler('start', start))
     
     # Callback Handlers
-    bot_app.add_handler(CallbackQueryHandler(menu_callback_handler, pattern="^(btn_|delch_|doff_)"))
+    bot_app.add_handler(CallbackQueryHandler(menu_callback_handler, pattern="^(btn_|delch_|doff_|omode_|phtml_|ret_)"))
 
     # ১. এডমিন ফাংশনস (বাটন ভিত্তিক কনভারসেশন)
     bot_app.add_handler(ConversationHandler(
@@ -425,15 +1567,21 @@ if __name__ == '__main__':
             CallbackQueryHandler(start_add_prem, pattern="^start_add_prem_btn$"),
             CallbackQueryHandler(start_gen_code, pattern="^start_gen_code_btn$"),
             CallbackQueryHandler(start_set_offer, pattern="^start_set_offer_btn$"),
-            CallbackQueryHandler(start_unpremium, pattern="^start_unpremium_btn$")
+            CallbackQueryHandler(start_unpremium, pattern="^start_unpremium_btn$"),
+            CallbackQueryHandler(start_revoke_batch, pattern="^start_revoke_batch_btn$"),
+            CallbackQueryHandler(start_broadcast, pattern="^start_broadcast_btn$")
         ],
         states={
             S_ADD_PREM_VAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_add_prem)],
             S_GEN_CODE_VAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_gen_code)],
             S_SET_OFFER_VAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_set_offer)],
-            S_UNPREMIUM: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_unpremium)]
+            S_UNPREMIUM: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_unpremium)],
+            S_REVOKE_BATCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_revoke_batch)],
+            S_BC_AUDIENCE: [CallbackQueryHandler(pick_bc_audience, pattern="^bc_(premium|all)$")],
+            S_BC_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_broadcast)]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="admin", persistent=True
     ))
 
     # ২. মুভি পোস্ট কনভারসেশন
@@ -448,36 +1596,70 @@ if __name__ == '__main__':
             LINK:[MessageHandler(filters.TEXT & ~filters.COMMAND, get_link)],
             CONFIRM_MORE:[CallbackQueryHandler(post_callback, pattern="^(add_q_c|done_q_c)$")]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="post", persistent=True
+    ))
+    bot_app.add_handler(ConversationHandler(
+        entry_points=[CommandHandler('bulkpost', start_bulkpost)],
+        states={S_BULK:[MessageHandler(filters.Document.ALL, save_bulkpost)]},
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="bulk", persistent=True
     ))
 
     # ৩. ক্লিক লিমিট কনভারসেশন
     bot_app.add_handler(ConversationHandler(
         entry_points=[CommandHandler('setclick', start_click), CallbackQueryHandler(start_click, pattern="^start_click_btn$")],
         states={S_CLICK:[MessageHandler(filters.TEXT & ~filters.COMMAND, save_click)]},
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="click", persistent=True
     ))
 
     # ৪. মনিটেগ জোন কনভারসেশন
     bot_app.add_handler(ConversationHandler(
         entry_points=[CommandHandler('addzone', start_zone), CallbackQueryHandler(start_zone, pattern="^start_zone_btn$")],
         states={S_ZONE:[MessageHandler(filters.TEXT & ~filters.COMMAND, save_zone)]},
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="zone", persistent=True
     ))
 
     # ৫. চ্যানেল অ্যাড কনভারসেশন
     bot_app.add_handler(ConversationHandler(
         entry_points=[CommandHandler('addchannel', start_addch), CallbackQueryHandler(start_addch, pattern="^start_addch_btn$")],
         states={CH_NAME:[MessageHandler(filters.TEXT & ~filters.COMMAND, save_ch_name)], CH_LINK:[MessageHandler(filters.TEXT & ~filters.COMMAND, save_ch_link)]},
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="addch", persistent=True
     ))
 
     # ৬. রিডিম কোড কনভারসেশন
     bot_app.add_handler(ConversationHandler(
         entry_points=[CommandHandler('redeem', start_redeem), CallbackQueryHandler(start_redeem, pattern="^start_redeem_btn$")],
         states={S_REDEEM:[MessageHandler(filters.TEXT & ~filters.COMMAND, save_redeem)]},
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="redeem", persistent=True
     ))
 
-    print("বট চলছে...")
-    bot_app.run_polling()
+    if METRICS_ENABLED: instrument_handlers(bot_app)
+    return bot_app
+
+# --- মেইন রানার ---
+if __name__ == '__main__':
+    if '--explain' in sys.argv:
+        for name, query, ok, stages in check_query_plans():
+            print(f"{'OK  ' if ok else 'SCAN'} {name} {query}: {stages}")
+        sys.exit(0)
+    if '--migrate-profiles' in sys.argv:
+        ensure_indexes()
+        counts = migrate_profiles()
+        print(counts if counts is not None else "মাইগ্রেশন আগেই সম্পন্ন হয়েছে, আবার চালানো হয়নি")
+        sys.exit(0)
+
+    TOKEN = os.environ.get('BOT_TOKEN')
+    ensure_indexes()
+    bot_app = build_application(TOKEN)
+    print(f"বট চলছে... ({BOT_MODE})")
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(bot_app))
+    else:
+        threading.Thread(target=run_flask, daemon=True).start()
+        threading.Thread(target=keep_alive, daemon=True).start()
+        bot_app.run_polling()